@@ -1,13 +1,27 @@
-import { NextResponse } from 'next/server';
+import { NextRequest, NextResponse } from 'next/server';
 export const maxDuration = 300;
-export async function POST(request: Request) {
+const SESSION_COOKIE = 'session_id';
+export async function POST(request: NextRequest) {
+  // Flask rate limits and keeps history per caller; without these headers every
+  // user would share this server's address. Flask must list this server in TRUSTED_PROXIES.
+  const sessionId = request.cookies.get(SESSION_COOKIE)?.value || crypto.randomUUID();
+  const forwardedFor = request.headers.get('x-forwarded-for') || request.headers.get('x-real-ip');
+  const withSession = (res: NextResponse) => {
+    res.cookies.set(SESSION_COOKIE, sessionId, {
+      httpOnly: true,
+      sameSite: 'lax',
+      secure: process.env.NODE_ENV === 'production',
+      maxAge: 60 * 60 * 24 * 30
+    });
+    return res;
+  };
   try {
     const { query, persona } = await request.json();
     if (!query) {
-      return NextResponse.json({
+      return withSession(NextResponse.json({
         status: 'error',
         message: 'No message provided'
-      }, { status: 400 });
+      }, { status: 400 }));
     }
     console.log('Sending request to Flask API:', query);
     const controller = new AbortController();
@@ -17,6 +31,8 @@ export async function POST(request: Request) {
       headers: {
         'Content-Type': 'application/json',
         'Accept': 'application/json',
+        'X-Session-Id': sessionId,
+        ...(forwardedFor ? { 'X-Forwarded-For': forwardedFor } : {}),
       },
       body: JSON.stringify({
         query: query,
@@ -35,19 +51,19 @@ export async function POST(request: Request) {
     if (!data || typeof data !== 'object') {
       throw new Error('Invalid response format from Flask API');
     }
-    return NextResponse.json(data);
+    return withSession(NextResponse.json(data));
   } catch (error) {
     console.error('API Error:', error);
     // Determine if it's a timeout error
     const isTimeout = error instanceof Error && error.name === 'AbortError';
-    return NextResponse.json({
+    return withSession(NextResponse.json({
       status: 'error',
       message: isTimeout
         ? 'Request timed out'
         : (error instanceof Error ? error.message : 'Internal server error')
     }, {
       status: isTimeout ? 408 : 500
-    });
+    }));
   }
 }
 
@@ -0,0 +1,329 @@
+import ipaddress
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, List, Optional, Sequence, Tuple, Union
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted right now"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, int(math.ceil(self.retry_after))))
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` tokens per second"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def available(self, cost: float = 1.0) -> Tuple[bool, float]:
+        """Refill, then report (enough tokens for `cost`, seconds until there are) without taking any"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            return True, 0.0
+        return False, (cost - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+    def try_acquire(self, cost: float = 1.0) -> Tuple[bool, float]:
+        """Take `cost` tokens. Returns (admitted, seconds until enough tokens are available)"""
+        admitted, retry_after = self.available(cost)
+        if admitted:
+            self.tokens -= cost
+        return admitted, retry_after
+
+
+class ClientRateLimiter:
+    """Per-client (IP or session) token buckets, bounded to the most recent clients.
+
+    Many users can share one address (NAT, or a proxy missing from
+    TRUSTED_PROXIES), so "ip:" buckets get `ip_multiplier` times the rate
+    and burst of a session.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: float, max_clients: int = 10000,
+                 ip_multiplier: float = 1.0):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_clients = max_clients
+        self.ip_multiplier = ip_multiplier
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _bucket(self, client_key: str) -> TokenBucket:
+        bucket = self._buckets.get(client_key)
+        if bucket is None:
+            scale = self.ip_multiplier if client_key.startswith("ip:") else 1.0
+            bucket = TokenBucket(self.rate * scale, self.burst * scale)
+            self._buckets[client_key] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client_key)
+        return bucket
+
+    def check(self, client_keys: Union[str, Sequence[str]], cost: float = 1.0) -> None:
+        """Charge `cost` to every key (e.g. session and IP); nothing is charged unless all have room"""
+        if isinstance(client_keys, str):
+            client_keys = (client_keys,)
+        with self._lock:
+            buckets = [self._bucket(key) for key in dict.fromkeys(client_keys)]
+            checks = [bucket.available(cost) for bucket in buckets]
+            admitted = all(ok for ok, _ in checks)
+            if admitted:
+                for bucket in buckets:
+                    bucket.tokens -= cost
+            else:
+                self.rejected += 1
+                retry_after = max(wait for _, wait in checks)
+        if not admitted:
+            raise AdmissionRejected("Rate limit exceeded", retry_after)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "tracked_clients": len(self._buckets),
+                "rate_per_minute": self.rate * 60.0,
+                "burst": self.burst,
+                "ip_multiplier": self.ip_multiplier,
+                "rejected": self.rejected
+            }
+
+
+class ProviderGate:
+    """Concurrency cap for one upstream provider with a bounded FIFO wait queue.
+
+    Priority requests never enter the queue: they run on a small set of
+    reserved slots on top of the normal cap, so cheap calls such as greetings
+    are not stuck behind long image analyses.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int,
+                 queue_timeout: float, priority_slots: int = 2):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.priority_slots = priority_slots
+        self._cond = threading.Condition()
+        self.active = 0
+        self.priority_active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.total_wait = 0.0
+        self.avg_hold = 1.0
+
+    def _retry_after(self) -> float:
+        # Rough estimate of when a slot frees up, based on recent hold times
+        return self.avg_hold * (1 + self.waiting / max(1, self.max_concurrent))
+
+    def acquire(self, priority: bool = False) -> Tuple[float, bool]:
+        """Take a slot. Returns (monotonic acquire time, whether a reserved slot was used)"""
+        with self._cond:
+            if priority:
+                reserved = self.active >= self.max_concurrent
+                if not reserved:
+                    self.active += 1
+                elif self.priority_active < self.priority_slots:
+                    self.priority_active += 1
+                else:
+                    self.rejected_queue_full += 1
+                    raise AdmissionRejected(f"{self.name} is at capacity", self._retry_after())
+                self.admitted += 1
+                return time.monotonic(), reserved
+
+            if self.active < self.max_concurrent and self.waiting == 0:
+                self.active += 1
+                self.admitted += 1
+                return time.monotonic(), False
+
+            if self.waiting >= self.max_queue:
+                self.rejected_queue_full += 1
+                raise AdmissionRejected(f"{self.name} queue is full", self._retry_after())
+
+            self.waiting += 1
+            started = time.monotonic()
+            deadline = started + self.queue_timeout
+            try:
+                while self.active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected_timeout += 1
+                        raise AdmissionRejected(f"Timed out waiting for {self.name}", self._retry_after())
+                    self._cond.wait(remaining)
+                self.active += 1
+                self.admitted += 1
+            finally:
+                self.waiting -= 1
+            now = time.monotonic()
+            self.total_wait += now - started
+            return now, False
+
+    def release(self, acquired_at: float, reserved: bool = False) -> None:
+        with self._cond:
+            if reserved:
+                self.priority_active -= 1
+            else:
+                self.active -= 1
+            held = time.monotonic() - acquired_at
+            self.avg_hold = 0.9 * self.avg_hold + 0.1 * held
+            self._cond.notify()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "active": self.active,
+                "priority_active": self.priority_active,
+                "waiting": self.waiting,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "rejected_queue_full": self.rejected_queue_full,
+                "rejected_timeout": self.rejected_timeout,
+                "avg_wait_seconds": round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+                "avg_hold_seconds": round(self.avg_hold, 4)
+            }
+
+
+class AdmissionTicket:
+    """Slots held by one admitted request. `release` is idempotent."""
+
+    def __init__(self, held: List[Tuple[ProviderGate, float, bool]]):
+        self._held = held
+        self._lock = threading.Lock()
+
+    def release(self) -> None:
+        with self._lock:
+            held, self._held = self._held, []
+        for gate, acquired_at, reserved in reversed(held):
+            gate.release(acquired_at, reserved)
+
+    def __enter__(self) -> "AdmissionTicket":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class AdmissionController:
+    """Per-client rate limiting plus per-provider concurrency caps"""
+
+    def __init__(self, limiter: ClientRateLimiter, gates: Dict[str, ProviderGate]):
+        self.limiter = limiter
+        self.gates = gates
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        queue_timeout = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', '10'))
+        max_queue = int(os.getenv('ADMISSION_MAX_QUEUE', '32'))
+        priority_slots = int(os.getenv('ADMISSION_PRIORITY_SLOTS', '2'))
+        limiter = ClientRateLimiter(
+            rate_per_minute=float(os.getenv('ADMISSION_RATE_PER_MINUTE', '30')),
+            burst=float(os.getenv('ADMISSION_BURST', '10')),
+            ip_multiplier=float(os.getenv('ADMISSION_IP_MULTIPLIER', '10'))
+        )
+        defaults = {"perplexity": 8, "openai": 16, "gemini": 4}
+        gates = {
+            name: ProviderGate(
+                name,
+                max_concurrent=int(os.getenv(f'ADMISSION_MAX_{name.upper()}', str(default))),
+                max_queue=max_queue,
+                queue_timeout=queue_timeout,
+                priority_slots=priority_slots
+            )
+            for name, default in defaults.items()
+        }
+        return cls(limiter, gates)
+
+    def admit(self, client_keys: Union[str, Sequence[str]], providers: Iterable[str] = (),
+              priority: bool = False, cost: float = 1.0) -> AdmissionTicket:
+        """Admit a request or raise AdmissionRejected"""
+        self.limiter.check(client_keys, cost)
+        return self.hold(providers, priority)
+
+    def hold(self, providers: Iterable[str], priority: bool = False) -> AdmissionTicket:
+        """Provider slots only, for follow-up calls made on behalf of an already admitted request"""
+        held: List[Tuple[ProviderGate, float, bool]] = []
+        try:
+            # Acquire in a fixed order so two requests never wait on each other
+            for name in sorted(set(providers)):
+                gate = self.gates[name]
+                held.append((gate, *gate.acquire(priority)))
+        except Exception:
+            AdmissionTicket(held).release()
+            raise
+        return AdmissionTicket(held)
+
+    def queue_depth(self) -> int:
+        return sum(gate.waiting for gate in self.gates.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "clients": self.limiter.snapshot(),
+            "providers": {name: gate.snapshot() for name, gate in self.gates.items()},
+            "queue_depth": self.queue_depth()
+        }
+
+
+def _parse_networks(value: str) -> Tuple:
+    networks = []
+    for item in value.split(','):
+        item = item.strip()
+        if item:
+            networks.append(ipaddress.ip_network(item, strict=False))
+    return tuple(networks)
+
+
+# Proxies (addresses or CIDR ranges) whose X-Forwarded-For is trusted, e.g. "10.0.0.0/8,127.0.0.1"
+TRUSTED_PROXIES = _parse_networks(os.getenv('TRUSTED_PROXIES', ''))
+
+
+def _is_trusted(address: str, trusted) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted)
+
+
+def client_ip_for(headers, remote_addr: Optional[str], trusted=TRUSTED_PROXIES) -> str:
+    """Peer address, or the closest untrusted X-Forwarded-For hop when the peer is a trusted proxy"""
+    address = remote_addr or 'unknown'
+    if not _is_trusted(address, trusted):
+        return address
+    hops = [hop.strip() for hop in headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+    # Walk from the right: each trusted proxy appended the address it received the request from
+    for hop in reversed(hops):
+        address = hop
+        if not _is_trusted(hop, trusted):
+            break
+    return address
+
+
+def client_keys_for(headers, remote_addr: Optional[str], trusted=TRUSTED_PROXIES) -> Tuple[str, ...]:
+    """Rate limit keys for a caller: always its IP, plus its session when it sends one.
+
+    The session header is client controlled, so it only narrows the limit; a
+    caller rotating session ids is still bounded by its IP bucket.
+    """
+    ip_key = f"ip:{client_ip_for(headers, remote_addr, trusted)}"
+    session_id = headers.get('X-Session-Id')
+    if session_id:
+        return (f"session:{session_id}", ip_key)
+    return (ip_key,)
@@ -0,0 +1,290 @@
+import atexit
+import csv
+import io
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, Generator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow as pa
+except ImportError:  # Arrow export is optional
+    pa = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_turns (
+    id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    persona TEXT,
+    category TEXT,
+    title TEXT,
+    query TEXT,
+    response TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_chat_turns_session ON chat_turns (session_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_chat_turns_created ON chat_turns (created_at);
+
+CREATE TABLE IF NOT EXISTS food_analyses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    category TEXT,
+    confidence REAL,
+    analysis TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_food_analyses_session ON food_analyses (session_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_food_analyses_created ON food_analyses (created_at);
+"""
+
+EXPORT_COLUMNS = {
+    "chat_turns": ["id", "session_id", "created_at", "persona", "category", "title", "query", "response"],
+    "food_analyses": ["id", "session_id", "created_at", "category", "confidence", "analysis"]
+}
+
+# Arrow type of each exported column that is not a string
+ARROW_TYPES = {
+    "chat_turns": {"created_at": "float64"},
+    "food_analyses": {"id": "int64", "created_at": "float64", "confidence": "float64"}
+}
+
+
+def arrow_schema(table: str):
+    """Fixed schema for a table, so all-NULL chunks cannot change a column's type mid-stream"""
+    types = ARROW_TYPES[table]
+    return pa.schema([
+        (name, pa.type_for_alias(types.get(name, "string"))) for name in EXPORT_COLUMNS[table]
+    ])
+
+
+class AnalyticsStore:
+    """Append-only SQLite (WAL) store for chat turns and food analyses.
+
+    Request threads only put records on a bounded queue; a single background
+    writer drains it and commits in batches. When the queue is full records
+    are dropped and counted rather than blocking a request.
+    """
+
+    def __init__(self, path: str, batch_size: int = 200, flush_interval: float = 1.0,
+                 max_pending: int = 10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.written = 0
+        self.dropped = 0
+        self._writer: Optional[threading.Thread] = None
+        self._writer_pid: Optional[int] = None
+        self._writer_lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+        atexit.register(self.close)
+
+    def _ensure_writer(self) -> None:
+        """Start the writer lazily, and again in each forked worker (threads do not survive fork)"""
+        if self._writer_pid == os.getpid():
+            return
+        with self._writer_lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._queue: "queue.Queue" = queue.Queue(maxsize=self.max_pending)
+            self._stopped = threading.Event()
+            self._writer = threading.Thread(target=self._run, name="analytics-writer", daemon=True)
+            self._writer.start()
+            self._writer_pid = os.getpid()
+
+    @classmethod
+    def from_env(cls) -> Optional["AnalyticsStore"]:
+        if os.getenv('ANALYTICS_ENABLED', 'true').lower() != 'true':
+            return None
+        try:
+            return cls(os.getenv('ANALYTICS_DB_PATH', 'analytics.db'))
+        except Exception as e:
+            logger.error(f"Analytics store disabled: {str(e)}")
+            return None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    # Write path (request threads)
+
+    def _enqueue(self, item: tuple) -> None:
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def record_chat_turn(self, session_id: str, turn: Dict[str, Any], category: str) -> None:
+        self._enqueue(("chat", (
+            turn["id"], session_id, time.time(), turn.get("persona"), category,
+            turn.get("title"), turn.get("query"), turn.get("response")
+        )))
+
+    def record_title(self, turn_id: str, title: str) -> None:
+        self._enqueue(("title", (title, turn_id)))
+
+    def record_food_analysis(self, session_id: str, result: Dict[str, Any]) -> None:
+        self._enqueue(("food", (
+            session_id, time.time(), result.get("category"), result.get("confidence"), result.get("analysis")
+        )))
+
+    # Background writer
+
+    def _run(self) -> None:
+        conn = self._connect()
+        try:
+            while not (self._stopped.is_set() and self._queue.empty()):
+                batch = self._drain()
+                if batch:
+                    self._write(conn, batch)
+        finally:
+            conn.close()
+
+    def _drain(self) -> List[tuple]:
+        batch: List[tuple] = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_interval))
+            while len(batch) < self.batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _write(self, conn: sqlite3.Connection, batch: List[tuple]) -> None:
+        chats = [row for kind, row in batch if kind == "chat"]
+        titles = [row for kind, row in batch if kind == "title"]
+        foods = [row for kind, row in batch if kind == "food"]
+        try:
+            with conn:
+                if chats:
+                    conn.executemany(
+                        "INSERT OR IGNORE INTO chat_turns "
+                        "(id, session_id, created_at, persona, category, title, query, response) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        chats
+                    )
+                if titles:
+                    conn.executemany("UPDATE chat_turns SET title = ? WHERE id = ?", titles)
+                if foods:
+                    conn.executemany(
+                        "INSERT INTO food_analyses (session_id, created_at, category, confidence, analysis) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        foods
+                    )
+            self.written += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.error(f"Analytics write failed: {str(e)}")
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Flush pending records and stop the writer"""
+        if self._writer is None or self._writer_pid != os.getpid():
+            return
+        self._stopped.set()
+        self._writer.join(timeout)
+
+    # Read path
+
+    def recent_turns(self, session_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """Most recent chat turns for a session, oldest first"""
+        conn = self._connect()
+        try:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                "SELECT id, persona, category, title, query, response, created_at FROM chat_turns "
+                "WHERE session_id = ? ORDER BY created_at DESC LIMIT ?",
+                (session_id, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            {
+                "id": row["id"],
+                "query": row["query"],
+                "response": row["response"],
+                "persona": row["persona"],
+                "title": row["title"],
+                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["created_at"]))
+            }
+            for row in reversed(rows)
+        ]
+
+    def _iter_rows(self, table: str, since: Optional[float], chunk_size: int) -> Generator:
+        if table not in EXPORT_COLUMNS:
+            raise ValueError(f"Unknown table: {table}")
+        columns = EXPORT_COLUMNS[table]
+        conn = self._connect()
+        try:
+            cursor = conn.execute(
+                f"SELECT {', '.join(columns)} FROM {table} WHERE created_at >= ? ORDER BY created_at",
+                (since or 0,)
+            )
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    def export_csv(self, table: str, since: Optional[float] = None,
+                   chunk_size: int = 1000) -> Generator[str, None, None]:
+        """Stream a table as CSV, one chunk of rows at a time"""
+        columns = EXPORT_COLUMNS.get(table)
+        if columns is None:
+            raise ValueError(f"Unknown table: {table}")
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for rows in self._iter_rows(table, since, chunk_size):
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    def export_arrow(self, table: str, since: Optional[float] = None,
+                     chunk_size: int = 5000) -> Generator[bytes, None, None]:
+        """Stream a table in Arrow IPC stream format, one record batch per chunk"""
+        if pa is None:
+            raise RuntimeError("pyarrow is not installed")
+        columns = EXPORT_COLUMNS.get(table)
+        if columns is None:
+            raise ValueError(f"Unknown table: {table}")
+        schema = arrow_schema(table)
+        sink = io.BytesIO()
+        writer = pa.ipc.new_stream(sink, schema)
+        for rows in self._iter_rows(table, since, chunk_size):
+            batch = pa.RecordBatch.from_pydict({
+                name: [row[i] for row in rows] for i, name in enumerate(columns)
+            }, schema=schema)
+            writer.write_batch(batch)
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+        writer.close()
+        yield sink.getvalue()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self._queue.qsize() if self._writer_pid == os.getpid() else 0,
+            "written": self.written,
+            "dropped": self.dropped
+        }
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+(?:-[0-9]+)?")
+
+STOPWORDS = {
+    "a", "an", "the", "i", "im", "me", "my", "is", "are", "am", "be", "it", "its", "to", "of",
+    "on", "in", "for", "and", "or", "while", "with", "when", "what", "whats", "do", "does",
+    "can", "should", "you", "your", "if", "about", "there", "any", "r", "u", "please", "tell"
+}
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return " ".join(_WORD_PATTERN.findall(query.lower().replace("glp-1", "glp1")))
+
+
+def query_key(query: str) -> str:
+    """Order-insensitive key of the meaningful words, so rephrasings share a key"""
+    words = {word for word in normalize_query(query).split() if word not in STOPWORDS}
+    return " ".join(sorted(words))
+
+
+class AnswerIndex:
+    """Vetted, precomputed answers for the most common questions.
+
+    The index is a JSON file produced by build_answer_index.py. It is loaded
+    once per worker and swapped atomically when the file changes on disk, so
+    answers can be updated without a restart. Only entries marked reviewed
+    are served.
+    """
+
+    def __init__(self, path: str, reload_interval: float = 30.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.version: Optional[str] = None
+        self._by_key: Dict[str, Dict[str, Any]] = {}
+        self._mtime: Optional[float] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reload()
+
+    @classmethod
+    def from_env(cls) -> "AnswerIndex":
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'answer_index.json')
+        return cls(
+            os.getenv('ANSWER_INDEX_PATH', default_path),
+            reload_interval=float(os.getenv('ANSWER_INDEX_RELOAD_SECONDS', '30'))
+        )
+
+    def reload(self) -> bool:
+        """Load the index if the file changed. Returns True when a new version was loaded."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            by_key: Dict[str, Dict[str, Any]] = {}
+            for entry in data.get("entries", []):
+                if not entry.get("reviewed"):
+                    continue
+                for question in [entry["question"]] + entry.get("variants", []):
+                    by_key[query_key(question)] = entry
+        except Exception as e:
+            logger.error(f"Keeping answer index {self.version}, failed to load {self.path}: {str(e)}")
+            self._mtime = mtime
+            return False
+
+        # Single reference swap; readers never see a half-built index
+        self._by_key = by_key
+        self._mtime = mtime
+        self.version = data.get("version")
+        logger.info(f"Loaded answer index {self.version} with {len(by_key)} keys")
+        return True
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return
+        if self._lock.acquire(blocking=False):
+            try:
+                self._checked = now
+                self.reload()
+            finally:
+                self._lock.release()
+
+    def _match(self, query: str, persona: str, category: str) -> Optional[Dict[str, Any]]:
+        self._maybe_reload()
+        entry = self._by_key.get(query_key(query))
+        if (entry is None
+                or persona not in entry.get("personas", ["glp1"])
+                or entry.get("category", category) != category):
+            return None
+        return entry
+
+    def lookup(self, query: str, persona: str, category: str) -> Optional[Dict[str, Any]]:
+        """Return the vetted entry for this query, or None"""
+        entry = self._match(query, persona, category)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def contains(self, query: str, persona: str, category: str) -> bool:
+        """Whether lookup() would hit, without counting towards the hit rate"""
+        return self._match(query, persona, category) is not None
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "version": self.version,
+            "keys": len(self._by_key),
+            "hits": self.hits,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
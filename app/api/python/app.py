@@ -1,37 +1,196 @@
 import requests
 import json
-from typing import Dict, Any, Optional, Generator, List, ClassVar
+from typing import Dict, Any, Optional, Generator, List, ClassVar, Callable
 import os
-from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context
+from flask import Flask, render_template, request, jsonify, session, Response, stream_with_context, g
 from flask_cors import CORS
+from flask_sock import Sock
 from dotenv import load_dotenv
 from datetime import datetime
 import openai
 import io
 import base64
+import hmac
 import logging
 from openai import OpenAI
 import re
 import google.generativeai as genai
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from functools import wraps
+from admission import AdmissionController, AdmissionRejected, client_keys_for
+from context_builder import ConversationContextBuilder, count_tokens
+from generation_policy import GenerationPolicy
+from food_parser import FoodAnalysisStreamParser, parse_food_analysis
+from request_context import RequestContext, SessionHistory, DEFAULT_SESSION
+from analytics_store import AnalyticsStore
+from answer_index import AnswerIndex
+from citations import CitationStreamProcessor, normalize_url, process_citations
+from lifecycle import lifecycle, CRITICAL_UPSTREAMS
+from diagnostics import latency, prober
+from profiling import request_profiler, sampler
+from chat_channel import ChatChannel
+from response_encoding import (
+    ORJSONProvider, StaticPayload, compress_response, compress_stream, negotiate_encoding
+)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 CORS(app, resources={
     r"/api/*": {
         "origins": ["http://localhost:3000"],
         "methods": ["POST", "GET", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"]
+        "allow_headers": ["Content-Type", "Authorization", "X-Session-Id"]
     }
 })
 
+sock = Sock(app)
+
 load_dotenv()
 
 # Food Analysis Labels
 LABELS = ["Clearly Healthy", "Borderline", "Mixed", "Clearly Unhealthy"]
 
+FOOD_ANALYSIS_PROMPT = """Analyze this food image and provide a comprehensive nutritional analysis:
+
+1. Health Category: Classify as one of:
+   - Clearly Healthy
+   - Borderline
+   - Mixed
+   - Clearly Unhealthy
+
+2. Confidence Score: Provide a confidence level (0-100%)
+
+3. Detailed Analysis:
+   Break down the following aspects:
+   - List of items in the image
+   - Caloric Content: Analyze the caloric density and impact
+   - Macronutrients: Evaluate proteins, fats, carbohydrates present
+   - Processing Level: Assess how processed the foods are
+   - Nutritional Profile: Identify key nutrients present or lacking
+   - Health Implications: Discuss potential health effects
+   - Portion Considerations: Comment on serving sizes if relevant
+
+Format your response exactly as:
+Category: [category]
+Confidence: [number]%
+Analysis:
+[Provide detailed analysis]"""
+
+GLP1_KEYWORDS = [
+    "glp-1", "glp1", "ozempic", "wegovy", "mounjaro", "rybelsus",
+    "semaglutide", "dulaglutide", "liraglutide", "tirzepatide"
+]
+
+# Used to build an instant title from the query category
+CATEGORY_TITLES = {
+    "dosage": "Dosage Guidance",
+    "side_effects": "Side Effects",
+    "benefits": "Benefits Overview",
+    "storage": "Storage Guidelines",
+    "lifestyle": "Diet and Lifestyle",
+    "interactions": "Drug Interactions",
+    "cost": "Cost and Coverage",
+    "general": "Overview"
+}
+
+NON_MEDICAL_RESPONSE = "I apologize, but I can only provide information about medications and directly related topics. Your question appears to be about something else. Please ask a question specifically about medications, their usage, effects, or related concerns."
+
+# Largest number of items accepted by /api/chat/batch
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '100'))
+WS_MAX_INFLIGHT = int(os.getenv('WS_MAX_INFLIGHT', '4'))
+# Each WebSocket holds a worker thread for its lifetime; keep the rest free for HTTP requests
+WS_MAX_CONNECTIONS = int(os.getenv('WS_MAX_CONNECTIONS', str(max(1, int(os.getenv('THREADS', '8')) // 2))))
+
+GREETINGS = [
+    'hello', 'hi', 'hey', 'good morning', 'good afternoon',
+    'good evening', 'howdy', 'greetings', 'hi there',
+    'bye', 'goodbye', 'see you', 'thanks', 'thank you'
+]
+
+# Admission control shared by all upstream-bound routes in this worker
+admission = AdmissionController.from_env()
+
+def admission_controlled(*providers, priority=None):
+    """Rate limit the caller and hold provider slots for the duration of the request.
+
+    `priority` is an optional callable returning True for cheap requests that
+    should use the priority lane instead of the provider wait queue.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            is_priority = bool(priority and priority())
+            try:
+                ticket = admission.admit(
+                    client_keys_for(request.headers, request.remote_addr),
+                    providers,
+                    priority=is_priority
+                )
+            except AdmissionRejected as e:
+                logger.warning(f"Rejected {request.path}: {e.reason}")
+                return jsonify({
+                    "status": "error",
+                    "message": e.reason,
+                    "retry_after": e.retry_after_header
+                }), 429, {'Retry-After': e.retry_after_header}
+
+            g.admission_ticket = ticket
+            try:
+                response = app.make_response(view(*args, **kwargs))
+            except Exception:
+                ticket.release()
+                raise
+            if response.is_streamed:
+                # Keep the slots until the stream is fully sent or the client disconnects
+                response.call_on_close(ticket.release)
+            else:
+                ticket.release()
+            return response
+        return wrapper
+    return decorator
+
+def _session_id() -> Optional[str]:
+    """Session identifier from the X-Session-Id header, JSON body or query string"""
+    data = request.get_json(silent=True) or {}
+    return request.headers.get('X-Session-Id') or data.get('session_id') or request.args.get('session_id')
+
+def _admin_authorized() -> bool:
+    """Admin-only routes require X-Admin-Token to match ADMIN_TOKEN; they are disabled when it is unset"""
+    token = os.getenv('ADMIN_TOKEN')
+    supplied = request.headers.get('X-Admin-Token', '')
+    return bool(token) and hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8'))
+
+def _stream_response(events, mimetype: str = 'text/event-stream') -> Response:
+    """Streamed response, compressed per chunk when the client accepts it"""
+    headers = {
+        'Cache-Control': 'no-cache',
+        'Connection': 'keep-alive',
+        'X-Accel-Buffering': 'no'
+    }
+    body = lifecycle.track_stream(stream_with_context(events))
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    if encoding:
+        body = compress_stream(body, encoding)
+        headers['Content-Encoding'] = encoding
+        headers['Vary'] = 'Accept-Encoding'
+    return Response(body, mimetype=mimetype, headers=headers)
+
+def _is_cheap_query(query: str, persona: str) -> bool:
+    """Greetings and vetted index answers take the priority lane instead of queueing behind upstream calls"""
+    return (query.lower().strip().replace('!', '') in GREETINGS
+            or HealthAssistant().has_indexed_answer(query, persona))
+
+def _is_priority_request() -> bool:
+    data = request.get_json(silent=True) or {}
+    return _is_cheap_query(data.get('query') or '', data.get('persona', 'general_med'))
+
 class UserProfileManager:
     def __init__(self, openai_client: OpenAI):
         self.client = openai_client
@@ -71,32 +230,47 @@ class UserProfileManager:
 
     def process_user_input(self, user_input: str, info_type: str) -> Dict[str, str]:
         try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": self.system_instructions[info_type]},
-                    {"role": "user", "content": user_input}
-                ]
-            )
+            with latency.measure("openai"):
+                response = self.client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=[
+                        {"role": "system", "content": self.system_instructions[info_type]},
+                        {"role": "user", "content": user_input}
+                    ]
+                )
             return json.loads(response.choices[0].message.content)
         except Exception as e:
             logger.error(f"Error processing input: {str(e)}")
             return {}
 
 class HealthAssistant:
+    """Shared, process-wide assistant.
+
+    After initialization the instance holds only clients, prompt tables and
+    internally synchronized caches/stores. Anything that varies per request
+    (persona, system prompt, session, deadline) travels in a RequestContext.
+    """
     _instance: ClassVar[Optional['HealthAssistant']] = None
+    _init_lock: ClassVar[threading.Lock] = threading.Lock()
     
     def __new__(cls):
         if cls._instance is None:
-            cls._instance = super().__new__(cls)
-            cls._instance.initialized = False
+            with cls._init_lock:
+                if cls._instance is None:
+                    instance = super().__new__(cls)
+                    instance.initialized = False
+                    cls._instance = instance
         return cls._instance
     
     def __init__(self):
         """Initialize both GLP-1 and Food Analysis capabilities"""
         if self.initialized:
             return
-            
+        with HealthAssistant._init_lock:
+            if not self.initialized:
+                self._initialize()
+
+    def _initialize(self) -> None:
         # GLP-1 Configuration
         self.pplx_api_key = os.getenv('PPLX_API_KEY')
         if not self.pplx_api_key:
@@ -115,9 +289,31 @@ class HealthAssistant:
         if not os.getenv('OPENAI_API_KEY'):
             raise ValueError("OpenAI API key not provided")
 
-        # Add conversation history management
-        self.conversation_history = []
-        self.max_history_length = 5
+        # Add conversation history management, kept per session
+        self.history = SessionHistory(max_turns=int(os.getenv('HISTORY_MAX_TURNS', '50')))
+        self.request_timeout = float(os.getenv('REQUEST_DEADLINE_SECONDS', '60'))
+
+        # Durable record of chat turns and food analyses, written off the request thread
+        self.analytics = AnalyticsStore.from_env()
+
+        # Reviewed answers for the most common questions, served without a provider call
+        self.answer_index = AnswerIndex.from_env()
+
+        # Prior turns sent upstream are selected under a token budget
+        self.context_builder = ConversationContextBuilder.from_env()
+
+        # Model, max_tokens and temperature are chosen per query category
+        self.generation_policy = GenerationPolicy.from_env()
+
+        # Titles are derived locally; the LLM title is an optional background refinement
+        self.refine_titles = os.getenv('TITLE_REFINEMENT', 'true').lower() == 'true'
+        self.title_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="title")
+        # Refinements queued or running; beyond this they are dropped and the local title stays
+        self.title_slots = threading.BoundedSemaphore(int(os.getenv('TITLE_MAX_PENDING', '32')))
+        self.titles_dropped = 0
+
+        # Upper bound on concurrent Perplexity calls made by one /api/chat/batch request
+        self.batch_workers = int(os.getenv('BATCH_MAX_WORKERS', '4'))
         
         # Add greeting system prompt
         self.greeting_system_prompt = """
@@ -262,10 +458,6 @@ Remember:
 """
         }
 
-        # Initialize with default persona
-        self.current_persona = "general_med"
-        self.initialized = True
-
         # Add rewrite prompt
         self.rewrite_prompt = """
         Given a user query about medications, create two things:
@@ -292,14 +484,24 @@ Remember:
         }
         """
 
-    def set_persona(self, persona: str) -> None:
-        """Set the current persona for the assistant"""
-        if persona in ["glp1", "general_med"]:
-            self.current_persona = persona
-        else:
+        # Only mark ready once every attribute exists, so other threads never see a partial instance
+        self.initialized = True
+
+    def new_context(self, persona: str, session_id: Optional[str] = None,
+                    timeout: Optional[float] = None) -> RequestContext:
+        """Build the immutable per-request context for the user-selected persona"""
+        if persona not in self.system_prompts:
             raise ValueError("Invalid persona specified")
+        timeout = self.request_timeout if timeout is None else timeout
+        return RequestContext(
+            persona=persona,
+            system_prompt=self.system_prompts[persona],
+            session_id=session_id or DEFAULT_SESSION,
+            deadline=time.monotonic() + timeout if timeout else None
+        )
 
-    def get_medical_response(self, query: str, selected_persona: str = "general_med") -> Dict[str, Any]:
+    def get_medical_response(self, query: str, selected_persona: str = "general_med",
+                             session_id: Optional[str] = None) -> Dict[str, Any]:
         """Get response based on user-selected persona"""
         try:
             if not query.strip():
@@ -308,8 +510,9 @@ Remember:
                     "message": "Please enter a valid question."
                 }
 
-            # Set the persona based on user selection
-            self.set_persona(selected_persona)
+            # Per-request state based on user selection
+            ctx = self.new_context(selected_persona, session_id)
+            history = self.prior_turns(ctx)
             
             # Handle greetings
             if self.is_greeting(query):
@@ -319,10 +522,30 @@ Remember:
                     "query": query,
                     "query_category": "greeting",
                     "response": greeting_response,
-                    "persona": self.current_persona,
+                    "persona": ctx.persona,
                     "title": "Greeting",
                     "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "conversation_history": self.conversation_history
+                    "conversation_history": history
+                }
+
+            # Vetted answers for the most common GLP-1 questions skip every provider call
+            indexed = self.lookup_indexed_answer(query, ctx)
+            if indexed is not None:
+                turn = self.record_turn(ctx, query, indexed["answer"], indexed["category"], history)
+                return {
+                    "status": "success",
+                    "id": turn["id"],
+                    "query": query,
+                    "query_category": indexed["category"],
+                    "response": indexed["answer"],
+                    "citations": indexed.get("citations", []),
+                    "source": "answer_index",
+                    "index_version": self.answer_index.version,
+                    "persona": ctx.persona,
+                    "title": turn["title"],
+                    "disclaimer": "Always consult your healthcare provider before making any changes to your medication or treatment plan.",
+                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "conversation_history": history
                 }
 
             # Add medication query validation for general_med persona
@@ -335,13 +558,14 @@ Remember:
                 Respond with only 'YES' if it's medication-related, or 'NO' if it's not.
                 """
                 
-                validation_response = self.openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "You are a query validator. Respond only with 'YES' or 'NO'."},
-                        {"role": "user", "content": validation_prompt}
-                    ]
-                )
+                with latency.measure("openai"):
+                    validation_response = self.openai_client.chat.completions.create(
+                        model="gpt-4o-mini",
+                        messages=[
+                            {"role": "system", "content": "You are a query validator. Respond only with 'YES' or 'NO'."},
+                            {"role": "user", "content": validation_prompt}
+                        ]
+                    )
                 
                 is_medication_related = validation_response.choices[0].message.content.strip().upper() == "YES"
                 
@@ -350,55 +574,40 @@ Remember:
                         "status": "success",
                         "query": query,
                         "query_category": "non_medical",
-                        "response": "I apologize, but I can only provide information about medications and directly related topics. Your question appears to be about something else. Please ask a question specifically about medications, their usage, effects, or related concerns.",
-                        "persona": self.current_persona,
+                        "response": NON_MEDICAL_RESPONSE,
+                        "persona": ctx.persona,
                         "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "conversation_history": self.conversation_history
+                        "conversation_history": history
                     }
 
-            # Get rewritten query and title
-            rewritten = self.rewrite_query(query)
-            title = rewritten.get("title", "Medical Query")
-
             # Continue with existing PPLX response logic
-            payload = {
-                "model": self.pplx_model,
-                "messages": [
-                    {"role": "system", "content": self.system_prompts[self.current_persona]},
-                    {"role": "user", "content": query}  # Use original query for response
-                ],
-                "temperature": 0.1,
-                "max_tokens": 1500
-            }
-            
-            response = requests.post(
-                "https://api.perplexity.ai/chat/completions",
-                headers=self.pplx_headers,
-                json=payload
+            query_category = self.categorize_query(query)
+            content = self.request_completion(
+                query,  # Use original query for response
+                ctx,
+                query_category,
+                history
             )
-            
-            response.raise_for_status()
-            response_data = response.json()
-            content = response_data['choices'][0]['message']['content']
+            content, citations = process_citations(content)
             
             # Update conversation history
-            self.conversation_history.append({
-                "query": query,
-                "response": content,
-                "persona": self.current_persona,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
+            turn = self.record_turn(ctx, query, content, query_category, history)
+            if ctx.has_session:
+                # The refined title only reaches the caller through its stored history
+                self.refine_title_async(turn)
             
             return {
                 "status": "success",
+                "id": turn["id"],
                 "query": query,
-                "query_category": self.categorize_query(query),
+                "query_category": query_category,
                 "response": content.strip(),
-                "persona": self.current_persona,
-                "title": title,  # Add the generated title
+                "citations": citations,
+                "persona": ctx.persona,
+                "title": turn["title"],  # Refined title is delivered via /api/chat-history
                 "disclaimer": "Always consult your healthcare provider before making any changes to your medication or treatment plan.",
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "conversation_history": self.conversation_history
+                "conversation_history": history
             }
             
         except Exception as e:
@@ -408,14 +617,250 @@ Remember:
                 "message": str(e)
             }
 
+    def lookup_indexed_answer(self, query: str, ctx: RequestContext) -> Optional[Dict[str, Any]]:
+        """Return the precomputed answer entry for a common GLP-1 question, if there is one"""
+        if not self.is_glp1_related(query):
+            return None
+        return self.answer_index.lookup(query, ctx.persona, self.categorize_query(query))
+
+    def has_indexed_answer(self, query: str, persona: str) -> bool:
+        """Whether lookup_indexed_answer would answer this query, for admission before the context exists"""
+        return (self.is_glp1_related(query)
+                and self.answer_index.contains(query, persona, self.categorize_query(query)))
+
+    def prior_turns(self, ctx: RequestContext) -> List[Dict[str, Any]]:
+        """Earlier turns of this caller's conversation; anonymous callers share DEFAULT_SESSION and get none"""
+        if not ctx.has_session:
+            return []
+        return self.session_turns(ctx.session_id)
+
+    def session_turns(self, session_id: str) -> List[Dict[str, Any]]:
+        """A session's turns from every worker, oldest first.
+
+        Workers share only the analytics store, so turns answered elsewhere are
+        read from it. Store writes land up to a flush interval late, so this
+        worker's own turns are merged in from memory. Without the store,
+        history is per worker and needs session affinity (see serve.py).
+        """
+        local = self.history.get(session_id)
+        if not self.analytics:
+            return local
+        try:
+            stored = self.analytics.recent_turns(session_id, self.history.max_turns)
+        except Exception as e:
+            logger.error(f"Reading history from the analytics store failed: {str(e)}")
+            return local
+        local_ids = {turn["id"] for turn in local}
+        turns = [turn for turn in stored if turn["id"] not in local_ids] + local
+        turns.sort(key=lambda turn: turn["timestamp"])
+        return turns[-self.history.max_turns:]
+
+    def record_turn(self, ctx: RequestContext, query: str, content: str, query_category: str,
+                    history: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """Append a completed turn to the session history and the analytics store.
+
+        Turns of anonymous callers (DEFAULT_SESSION) are neither kept nor persisted.
+        """
+        turn = {
+            "id": uuid.uuid4().hex,
+            "query": query,
+            "response": content,
+            "persona": ctx.persona,
+            "title": self.local_title(query, query_category, ctx.persona),
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        if history is not None:
+            history.append(turn)
+        if not ctx.has_session:
+            return turn
+        self.history.append(ctx.session_id, turn)
+        if self.analytics:
+            self.analytics.record_chat_turn(ctx.session_id, turn, query_category)
+        return turn
+
+    def request_completion(self, query: str, ctx: RequestContext, query_category: str,
+                           history: Optional[List[Dict[str, Any]]] = None) -> str:
+        """Call Perplexity with the generation policy for this category and return the answer text"""
+        generation = self.generation_policy.resolve(query_category, ctx.persona)
+        payload = {
+            "model": generation["model"],
+            "messages": self.context_builder.build_messages(
+                ctx.system_prompt,
+                query,
+                history if history and ctx.has_session else [],
+                ctx.persona
+            ),
+            "temperature": generation["temperature"],
+            "max_tokens": generation["max_tokens"]
+        }
+
+        started = time.monotonic()
+        with latency.measure("perplexity"):
+            response = requests.post(
+                "https://api.perplexity.ai/chat/completions",
+                headers=self.pplx_headers,
+                json=payload,
+                timeout=ctx.remaining()
+            )
+
+        response.raise_for_status()
+        response_data = response.json()
+        content = response_data['choices'][0]['message']['content']
+        self.generation_policy.stats.record(
+            query_category,
+            generation["model"],
+            time.monotonic() - started,
+            response_data.get('usage', {}).get('completion_tokens') or count_tokens(content)
+        )
+        return content
+
+    def validate_medication_queries(self, queries: List[str]) -> List[bool]:
+        """Classify many queries as medication-related or not with a single classifier call"""
+        if not queries:
+            return []
+
+        numbered = "\n".join(f"{i + 1}. {query}" for i, query in enumerate(queries))
+        validation_prompt = f"""
+        For each numbered query below, determine if it is related to medications, drugs, or pharmaceutical treatments.
+
+        Queries:
+        {numbered}
+
+        Respond with JSON only: {{"results": ["YES" or "NO", ...]}} with exactly {len(queries)} entries in the same order.
+        """
+
+        try:
+            with latency.measure("openai"):
+                validation_response = self.openai_client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=[
+                        {"role": "system", "content": "You are a query validator. Respond only with the requested JSON."},
+                        {"role": "user", "content": validation_prompt}
+                    ],
+                    response_format={"type": "json_object"}
+                )
+            results = json.loads(validation_response.choices[0].message.content)["results"]
+            if len(results) != len(queries):
+                raise ValueError(f"Expected {len(queries)} results, got {len(results)}")
+            return [str(result).strip().upper() == "YES" for result in results]
+        except Exception as e:
+            # The persona system prompt still refuses off-topic questions
+            logger.error(f"Batch validation failed, allowing all queries: {str(e)}")
+            return [True] * len(queries)
+
+    def get_batch_responses(self, items: List[Dict[str, Any]], client_keys: tuple = ()) -> Generator:
+        """Answer many queries, yielding one NDJSON line per input item as answers finish.
+
+        Each upstream answer is charged one token to `client_keys` when it is
+        submitted and holds its own Perplexity slot, so a batch obeys the same
+        limits as separate requests. Items the rate limit turns away get an
+        error line with code 429 and a Retry-After they can actually meet.
+        """
+        # Deduplicate identical (query, persona) pairs; every input index still gets a line
+        unique: Dict[tuple, List[int]] = {}
+        for index, item in enumerate(items):
+            query = (item.get("query") or "").strip()
+            persona = item.get("persona", "general_med")
+            if not query or persona not in self.system_prompts:
+                yield json.dumps({
+                    "index": index,
+                    "status": "error",
+                    "message": "Invalid query or persona"
+                }) + "\n"
+                continue
+            unique.setdefault((" ".join(query.lower().split()), persona), []).append(index)
+
+        pending = []
+        to_validate = []
+        for key, indexes in unique.items():
+            query = items[indexes[0]]["query"].strip()
+            if self.is_greeting(query):
+                yield from self._batch_lines(indexes, {
+                    "status": "success",
+                    "query": query,
+                    "query_category": "greeting",
+                    "response": self.handle_greeting(query),
+                    "persona": key[1]
+                })
+            elif key[1] == "general_med":
+                to_validate.append((key, query))
+            else:
+                pending.append((key, query))
+
+        verdicts = self.validate_medication_queries([query for _, query in to_validate])
+        for (key, query), is_medication_related in zip(to_validate, verdicts):
+            if is_medication_related:
+                pending.append((key, query))
+            else:
+                yield from self._batch_lines(unique[key], {
+                    "status": "success",
+                    "query": query,
+                    "query_category": "non_medical",
+                    "response": NON_MEDICAL_RESPONSE,
+                    "persona": key[1]
+                })
+
+        def answer(key, query):
+            query_category = self.categorize_query(query)
+            with admission.hold(("perplexity",)):
+                completion = self.request_completion(query, self.new_context(key[1]), query_category)
+            content, citations = process_citations(completion)
+            return {
+                "status": "success",
+                "query": query,
+                "query_category": query_category,
+                "response": content.strip(),
+                "citations": citations,
+                "persona": key[1],
+                "title": self.local_title(query, query_category, key[1]),
+                "disclaimer": "Always consult your healthcare provider before making any changes to your medication or treatment plan."
+            }
+
+        if not pending:
+            return
+        queued = iter(pending)
+        futures: Dict[Any, tuple] = {}
+        with ThreadPoolExecutor(max_workers=min(self.batch_workers, len(pending)),
+                                thread_name_prefix="batch") as pool:
+            while True:
+                # Charge each item as it goes to the pool, so a long batch is paced by
+                # the client's refill rate instead of needing its whole cost up front
+                while len(futures) < self.batch_workers:
+                    key, query = next(queued, (None, None))
+                    if key is None:
+                        break
+                    try:
+                        admission.limiter.check(client_keys)
+                    except AdmissionRejected as e:
+                        yield from self._batch_lines(unique[key], {
+                            "status": "error",
+                            "code": 429,
+                            "message": e.reason,
+                            "retry_after": e.retry_after_header
+                        })
+                        continue
+                    futures[pool.submit(answer, key, query)] = key
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Error in batch item: {str(e)}")
+                        result = {"status": "error", "message": str(e)}
+                    yield from self._batch_lines(unique[key], result)
+
+    def _batch_lines(self, indexes: List[int], result: Dict[str, Any]) -> Generator:
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        for index in indexes:
+            yield json.dumps({"index": index, **result, "timestamp": timestamp}) + "\n"
+
     def is_glp1_related(self, query: str) -> bool:
         """Determine if the query is GLP-1 related"""
-        glp1_keywords = [
-            "glp-1", "glp1", "ozempic", "wegovy", "mounjaro", "rybelsus",
-            "semaglutide", "dulaglutide", "liraglutide", "tirzepatide"
-        ]
         query_lower = query.lower()
-        return any(keyword in query_lower for keyword in glp1_keywords)
+        return any(keyword in query_lower for keyword in GLP1_KEYWORDS)
 
     def get_glp1_response(self, query: str) -> Dict[str, Any]:
         """Get response for GLP-1 related queries"""
@@ -469,7 +914,7 @@ Remember:
                     "query_category": "greeting",
                     "response": greeting_response,
                     "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "conversation_history": self.conversation_history
+                    "conversation_history": self.get_conversation_history()
                 }
             elif "UNRELATED" in message_type:
                 return {
@@ -478,7 +923,7 @@ Remember:
                     "query_category": "unrelated",
                     "response": "I apologize, but I can only provide information about GLP-1 medications and related topics. Please ask a question specifically about GLP-1 medications, their usage, effects, or related concerns.",
                     "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "conversation_history": self.conversation_history
+                    "conversation_history": self.get_conversation_history()
                 }
 
             # Continue with existing PPLX response for GLP1 queries
@@ -492,7 +937,7 @@ Remember:
                 "max_tokens": 1500
             }
             
-            logger.info(f"Sending request with messages: {payload['messages']}")  # Debug log
+            logger.debug("Sending request with messages: %s", payload['messages'])
             
             response = requests.post(
                 "https://api.perplexity.ai/chat/completions",
@@ -500,24 +945,14 @@ Remember:
                 json=payload
             )
             
-            logger.info(f"API Response status: {response.status_code}")  
+            logger.debug("API Response status: %s", response.status_code)
             
             response.raise_for_status()
             response_data = response.json()
             content = response_data['choices'][0]['message']['content']
             
-            # Update conversation history
-            self.conversation_history.append({
-                "query": query,
-                "response": content,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
-            
-            # Maintain history size
-            if len(self.conversation_history) > self.max_history_length:
-                self.conversation_history.pop(0)
-            
-            logger.info(f"Generated response: {content[:100]}...")  
+            # Legacy path has no session, so the turn is not kept in any shared history
+            logger.debug("Generated response: %.100s...", content)
             
             return {
                 "status": "success",
@@ -526,7 +961,7 @@ Remember:
                 "response": content.strip(),
                 "disclaimer": "Always consult your healthcare provider before making any changes to your medication or treatment plan.",
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "conversation_history": self.conversation_history
+                "conversation_history": self.get_conversation_history()
             }
             
         except Exception as e:
@@ -539,15 +974,20 @@ Remember:
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
     
-    def clear_conversation_history(self):
+    def clear_conversation_history(self, session_id: Optional[str] = None):
         """Clear the conversation history"""
-        self.conversation_history = []
+        self.history.clear(session_id or DEFAULT_SESSION)
     
-    def get_conversation_history(self) -> List[Dict[str, Any]]:
-        """Get the current conversation history"""
-        return self.conversation_history
+    def get_conversation_history(self, session_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get the current conversation history, including turns answered by other workers.
+
+        Callers without a session id share DEFAULT_SESSION, so it has no history to serve.
+        """
+        if not session_id or session_id == DEFAULT_SESSION:
+            return []
+        return self.session_turns(session_id)
 
-    def analyze_food(self, image_data) -> Dict[str, Any]:
+    def analyze_food(self, image_data, session_id: Optional[str] = None) -> Dict[str, Any]:
         """Analyze food image using Gemini 1.5 Flash"""
         try:
             # Create image data for Gemini
@@ -556,61 +996,20 @@ Remember:
                 "data": image_data
             }
 
-            prompt = """Analyze this food image and provide a comprehensive nutritional analysis:
-
-1. Health Category: Classify as one of:
-   - Clearly Healthy
-   - Borderline
-   - Mixed
-   - Clearly Unhealthy
-
-2. Confidence Score: Provide a confidence level (0-100%)
-
-3. Detailed Analysis:
-   Break down the following aspects:
-   - List of items in the image
-   - Caloric Content: Analyze the caloric density and impact
-   - Macronutrients: Evaluate proteins, fats, carbohydrates present
-   - Processing Level: Assess how processed the foods are
-   - Nutritional Profile: Identify key nutrients present or lacking
-   - Health Implications: Discuss potential health effects
-   - Portion Considerations: Comment on serving sizes if relevant
-
-Format your response exactly as:
-Category: [category]
-Confidence: [number]%
-Analysis:
-[Provide detailed analysis]"""
+            prompt = FOOD_ANALYSIS_PROMPT
 
             # Generate response using Gemini
-            response = self.gemini_model.generate_content([prompt, image])
-            analysis_text = response.text
-
-            # Parse the response (same as before)
-            lines = analysis_text.split('\n')
-            
-            category = ""
-            confidence = 0
-            analysis = []
-            current_section = ""
-
-            for line in lines:
-                if line.startswith('Category:'):
-                    category = line.split(':', 1)[1].strip()
-                elif line.startswith('Confidence:'):
-                    confidence = float(line.split(':', 1)[1].strip().replace('%', ''))
-                elif line.startswith('Analysis:'):
-                    current_section = "analysis"
-                elif current_section == "analysis":
-                    analysis.append(line.strip())
-
-            analysis_text = '\n'.join(analysis)
+            with latency.measure("gemini"):
+                response = self.gemini_model.generate_content([prompt, image])
+            parsed = parse_food_analysis(response.text)
+            if self.analytics:
+                self.analytics.record_food_analysis(session_id or DEFAULT_SESSION, parsed)
             
             return {
                 "status": "success",
-                "category": category,
-                "confidence": confidence,
-                "analysis": analysis_text,
+                "category": parsed["category"],
+                "confidence": parsed["confidence"],
+                "analysis": parsed["analysis"],
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
             
@@ -622,6 +1021,52 @@ Analysis:
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             }
 
+    def analyze_food_stream(self, image_data, session_id: Optional[str] = None) -> Generator:
+        """Stream a food analysis, emitting category and confidence as soon as they are parsed"""
+        try:
+            image = {
+                "mime_type": "image/jpeg",
+                "data": image_data
+            }
+            parser = FoodAnalysisStreamParser()
+            # Streaming calls are timed to the first response, which is what callers wait on
+            with latency.measure("gemini"):
+                response = self.gemini_model.generate_content([FOOD_ANALYSIS_PROMPT, image], stream=True)
+
+            for chunk in response:
+                text = getattr(chunk, "text", "")
+                if not text:
+                    continue
+                for event in parser.feed(text):
+                    yield self._food_event(event)
+            for event in parser.close():
+                yield self._food_event(event)
+
+            result = parser.result()
+            if self.analytics:
+                self.analytics.record_food_analysis(session_id or DEFAULT_SESSION, result)
+            yield json.dumps({
+                "status": "complete",
+                "category": result["category"],
+                "confidence": result["confidence"],
+                "analysis": result["analysis"],
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            })
+
+        except Exception as e:
+            logger.error(f"Error in analyze_food_stream: {str(e)}")
+            yield json.dumps({
+                "status": "error",
+                "message": str(e),
+                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            })
+
+    def _food_event(self, event: tuple) -> str:
+        kind, value = event
+        if kind == "analysis":
+            return json.dumps({"status": "streaming", "content": value})
+        return json.dumps({"status": kind, kind: value})
+
     def categorize_query(self, query: str) -> str:
         """Categorize the user query"""
         categories = {
@@ -643,15 +1088,16 @@ Analysis:
     def handle_greeting(self, message: str) -> str:
         """Handle greeting messages"""
         try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": self.greeting_system_prompt},
-                    {"role": "user", "content": message}
-                ],
-                temperature=0.7,
-                max_tokens=50
-            )
+            with latency.measure("openai"):
+                response = self.openai_client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=[
+                        {"role": "system", "content": self.greeting_system_prompt},
+                        {"role": "user", "content": message}
+                    ],
+                    temperature=0.7,
+                    max_tokens=50
+                )
             return response.choices[0].message.content.strip()
         except Exception as e:
             logger.error(f"Error in handle_greeting: {str(e)}")
@@ -659,21 +1105,25 @@ Analysis:
 
     def is_greeting(self, message: str) -> bool:
         """Check if the message is a greeting"""
-        greetings = [
-            'hello', 'hi', 'hey', 'good morning', 'good afternoon', 
-            'good evening', 'howdy', 'greetings', 'hi there',
-            'bye', 'goodbye', 'see you', 'thanks', 'thank you'
-        ]
-        return message.lower().strip().replace('!', '') in greetings
-
-    def get_streaming_response(self, query: str, selected_persona: str = "general_med") -> Generator:
-        """Get streaming response based on user-selected persona"""
+        return message.lower().strip().replace('!', '') in GREETINGS
+
+    def get_streaming_response(self, query: str, selected_persona: str = "general_med",
+                               session_id: Optional[str] = None,
+                               cancel: Optional[threading.Event] = None,
+                               release: Optional[Callable[[], None]] = None) -> Generator:
+        """Get streaming response based on user-selected persona.
+
+        Setting `cancel` aborts the upstream stream at the next received line;
+        the turn is then not recorded and a 'cancelled' event is emitted.
+        `release` is called once the answer is complete, before waiting on the
+        refined title, so the caller can free its provider slots early.
+        """
         try:
             if not query.strip():
                 yield json.dumps({"status": "error", "message": "Please enter a valid question."})
                 return
 
-            self.set_persona(selected_persona)
+            ctx = self.new_context(selected_persona, session_id)
             
             if self.is_greeting(query):
                 yield json.dumps({
@@ -681,68 +1131,136 @@ Analysis:
                     "query": query,
                     "query_category": "greeting",
                     "response": self.handle_greeting(query),
-                    "persona": self.current_persona,
+                    "persona": ctx.persona,
+                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                })
+                return
+
+            indexed = self.lookup_indexed_answer(query, ctx)
+            if indexed is not None:
+                turn = self.record_turn(ctx, query, indexed["answer"], indexed["category"])
+                yield json.dumps({
+                    "status": "complete",
+                    "id": turn["id"],
+                    "query": query,
+                    "query_category": indexed["category"],
+                    "full_response": indexed["answer"],
+                    "citations": indexed.get("citations", []),
+                    "source": "answer_index",
+                    "index_version": self.answer_index.version,
+                    "persona": ctx.persona,
+                    "title": turn["title"],
+                    "disclaimer": "Always consult your healthcare provider before making any changes to your medication or treatment plan.",
                     "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
                 })
                 return
 
             # Streaming payload for PPLX
+            query_category = self.categorize_query(query)
+            generation = self.generation_policy.resolve(query_category, ctx.persona)
             payload = {
-                "model": self.pplx_model,
-                "messages": [
-                    {"role": "system", "content": self.system_prompts[self.current_persona]},
-                    {"role": "user", "content": query}
-                ],
-                "temperature": 0.1,
-                "max_tokens": 1500,
+                "model": generation["model"],
+                "messages": self.context_builder.build_messages(
+                    ctx.system_prompt,
+                    query,
+                    self.prior_turns(ctx),
+                    ctx.persona
+                ),
+                "temperature": generation["temperature"],
+                "max_tokens": generation["max_tokens"],
                 "stream": True  # Enable streaming
             }
             
-            response = requests.post(
-                "https://api.perplexity.ai/chat/completions",
-                headers=self.pplx_headers,
-                json=payload,
-                stream=True  # Enable streaming for requests
-            )
+            started = time.monotonic()
+            with latency.measure("perplexity"):
+                response = requests.post(
+                    "https://api.perplexity.ai/chat/completions",
+                    headers=self.pplx_headers,
+                    json=payload,
+                    stream=True,  # Enable streaming for requests
+                    timeout=ctx.remaining()
+                )
             
             response.raise_for_status()
             
             full_response = ""
-            for line in response.iter_lines():
-                if line:
-                    try:
-                        json_response = json.loads(line.decode('utf-8').replace('data: ', ''))
-                        if 'choices' in json_response:
-                            content = json_response['choices'][0].get('delta', {}).get('content', '')
-                            if content:
-                                full_response += content
-                                yield json.dumps({
-                                    "status": "streaming",
-                                    "content": content,
-                                    "persona": self.current_persona
-                                }) + '\n'
-                    except json.JSONDecodeError:
-                        continue
+            citation_processor = CitationStreamProcessor()
+            try:
+                for line in response.iter_lines():
+                    if cancel is not None and cancel.is_set():
+                        break
+                    if line:
+                        try:
+                            json_response = json.loads(line.decode('utf-8').replace('data: ', ''))
+                            if 'choices' in json_response:
+                                content = json_response['choices'][0].get('delta', {}).get('content', '')
+                                # Citations are normalized as they stream; a few characters may be held back
+                                content = citation_processor.feed(content) if content else ''
+                                if content:
+                                    full_response += content
+                                    yield json.dumps({
+                                        "status": "streaming",
+                                        "content": content,
+                                        "persona": ctx.persona
+                                    }) + '\n'
+                        except json.JSONDecodeError:
+                            continue
+            finally:
+                # Closing the connection stops generation upstream on cancel or client disconnect
+                response.close()
+
+            if cancel is not None and cancel.is_set():
+                yield json.dumps({"status": "cancelled"})
+                return
+
+            tail = citation_processor.close()
+            if tail:
+                full_response += tail
+                yield json.dumps({
+                    "status": "streaming",
+                    "content": tail,
+                    "persona": ctx.persona
+                }) + '\n'
+
+            self.generation_policy.stats.record(
+                query_category,
+                generation["model"],
+                time.monotonic() - started,
+                count_tokens(full_response)
+            )
 
             # Update conversation history after complete response
-            self.conversation_history.append({
-                "query": query,
-                "response": full_response,
-                "persona": self.current_persona,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            })
+            turn = self.record_turn(ctx, query, full_response, query_category)
+            refinement = self.refine_title_async(turn)
 
             # Send final message
             yield json.dumps({
                 "status": "complete",
+                "id": turn["id"],
                 "query": query,
-                "query_category": self.categorize_query(query),
+                "query_category": query_category,
                 "full_response": full_response,
-                "persona": self.current_persona,
+                "citations": citation_processor.citations,
+                "persona": ctx.persona,
+                "title": turn["title"],
                 "disclaimer": "Always consult your healthcare provider before making any changes to your medication or treatment plan.",
                 "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             })
 
+            # The answer is already delivered; a refined title follows as a trailing event
+            if release is not None:
+                release()
+            if refinement is not None:
+                try:
+                    refinement.result(timeout=5)
+                    yield json.dumps({
+                        "status": "title",
+                        "id": turn["id"],
+                        "title": turn["title"]
+                    })
+                except Exception as e:
+                    logger.warning(f"Title refinement not delivered: {str(e)}")
+
         except Exception as e:
             logger.error(f"Error in get_streaming_response: {str(e)}")
             yield json.dumps({
@@ -750,23 +1268,62 @@ Analysis:
                 "message": str(e)
             })
 
+    def local_title(self, query: str, category: str, persona: str) -> str:
+        """Build a title from drug keywords and the query category without any API call"""
+        query_lower = query.lower()
+        drug = next((keyword for keyword in GLP1_KEYWORDS if keyword in query_lower), None)
+        if drug in ("glp-1", "glp1"):
+            subject = "GLP-1"
+        elif drug:
+            subject = drug.capitalize()
+        else:
+            subject = "GLP-1" if persona == "glp1" else "Medication"
+        return f"{subject} {CATEGORY_TITLES.get(category, 'Overview')}"
+
+    def refine_title_async(self, turn: Dict[str, Any]):
+        """Replace the local title with an LLM title in the background. Returns the future, if any."""
+        if not self.refine_titles:
+            return None
+
+        if not self.title_slots.acquire(blocking=False):
+            self.titles_dropped += 1
+            return None
+
+        def refine():
+            try:
+                with admission.hold(("openai",)):
+                    result = self.rewrite_query(turn["query"])
+                if result.get("title") and result["title"] != "Medical Query":
+                    turn["title"] = result["title"]
+                    if self.analytics:
+                        self.analytics.record_title(turn["id"], turn["title"])
+            finally:
+                self.title_slots.release()
+
+        try:
+            return self.title_executor.submit(refine)
+        except RuntimeError:
+            self.title_slots.release()
+            raise
+
     def rewrite_query(self, query: str) -> Dict[str, str]:
         """Rewrite the user query and generate a title"""
         try:
-            logger.info(f"Starting query rewrite for: {query}")
+            logger.debug("Starting query rewrite for: %s", query)
             
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {"role": "system", "content": self.rewrite_prompt},
-                    {"role": "user", "content": query}
-                ],
-                temperature=0.7,
-                max_tokens=150
-            )
+            with latency.measure("openai"):
+                response = self.openai_client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=[
+                        {"role": "system", "content": self.rewrite_prompt},
+                        {"role": "user", "content": query}
+                    ],
+                    temperature=0.7,
+                    max_tokens=150
+                )
             
             result = json.loads(response.choices[0].message.content)
-            logger.info(f"Parsed result: {result}")
+            logger.debug("Parsed result: %s", result)
             
             # Validate the result has required fields
             if not all(key in result for key in ["rewritten_query", "title"]):
@@ -789,6 +1346,7 @@ def serve_spa():
     return render_template('index.html')
 
 @app.route('/api/chat', methods=['POST'])
+@admission_controlled("openai", "perplexity", priority=_is_priority_request)
 def chat():
     try:
         data = request.get_json()
@@ -802,7 +1360,7 @@ def chat():
             }), 400
 
         assistant = HealthAssistant()
-        response = assistant.get_medical_response(query, selected_persona)
+        response = assistant.get_medical_response(query, selected_persona, _session_id())
         
         return jsonify(response)
 
@@ -813,7 +1371,47 @@ def chat():
             "message": str(e)
         }), 500
 
+@app.route('/api/chat/batch', methods=['POST'])
+@admission_controlled("openai")
+def chat_batch():
+    try:
+        data = request.get_json()
+        items = data.get('items') if data else None
+
+        if not items or not isinstance(items, list):
+            return jsonify({
+                "status": "error",
+                "message": "No items provided"
+            }), 400
+
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({
+                "status": "error",
+                "message": f"At most {BATCH_MAX_ITEMS} items per batch"
+            }), 400
+
+        if not all(isinstance(item, dict) for item in items):
+            return jsonify({
+                "status": "error",
+                "message": "Each item must be an object with query and persona"
+            }), 400
+
+        assistant = HealthAssistant()
+
+        client_keys = client_keys_for(request.headers, request.remote_addr)
+
+        return _stream_response(assistant.get_batch_responses(items, client_keys),
+                                mimetype='application/x-ndjson')
+
+    except Exception as e:
+        logger.error(f"Error in chat_batch endpoint: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
 @app.route('/api/analyze-food', methods=['POST'])
+@admission_controlled("gemini")
 def analyze_food():
     try:
         if 'image' not in request.files:
@@ -826,7 +1424,7 @@ def analyze_food():
         image_data = image_file.read()
         
         assistant = HealthAssistant()
-        response = assistant.analyze_food(image_data)
+        response = assistant.analyze_food(image_data, _session_id())
         
         return jsonify(response)
 
@@ -837,6 +1435,7 @@ def analyze_food():
         }), 500
 
 @app.route('/api/calculator', methods=['POST'])
+@admission_controlled("gemini")
 def analyze_image():
     try:
         data = request.json
@@ -852,9 +1451,9 @@ def analyze_image():
         
         # Process image using HealthAssistant
         health_assistant = HealthAssistant()
-        result = health_assistant.analyze_food(image_data)
+        result = health_assistant.analyze_food(image_data, _session_id())
         
-        logger.info(f"Image analysis completed: {result}")
+        logger.debug("Image analysis completed: %s", result)
         
         return jsonify(result)  # Return the result directly
 
@@ -865,12 +1464,151 @@ def analyze_image():
             'message': str(e)
         }), 500
 
+@app.route('/api/calculator/stream', methods=['POST'])
+@admission_controlled("gemini")
+def analyze_image_stream():
+    try:
+        data = request.json
+        if not data or 'image' not in data:
+            logger.error("No image data in request")
+            return jsonify({
+                'status': 'error',
+                'message': 'No image data provided'
+            }), 400
+
+        image_data = base64.b64decode(data['image'].split(',')[1])
+        health_assistant = HealthAssistant()
+        session_id = _session_id()
+
+        def generate():
+            for event in health_assistant.analyze_food_stream(image_data, session_id):
+                yield f"data: {event}\n\n"
+
+        return _stream_response(generate())
+
+    except Exception as e:
+        logger.error(f"Error in analyze_image_stream: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@app.before_request
+def start_request_profile():
+    """Admins can profile a single request by sending X-Profile: 1"""
+    if request.headers.get('X-Profile') == '1' and _admin_authorized():
+        g.profile = request_profiler.start(request.path)
+
+@app.after_request
+def finish_request_profile(response):
+    capture = g.pop('profile', None)
+    if capture is None:
+        return response
+    response.headers['X-Profile-Id'] = capture.id
+    if response.is_streamed:
+        response.response = request_profiler.finish_after(capture, response.response)
+        # Also runs when the client disconnects before the body is iterated
+        response.call_on_close(lambda: request_profiler.finish(capture))
+    else:
+        request_profiler.finish(capture)
+    return response
+
+@app.after_request
+def compress(response):
+    return compress_response(response, request.headers.get('Accept-Encoding'))
+
+@app.teardown_request
+def count_request(exc=None):
+    # Teardown also runs for requests that raised, so every request is counted
+    lifecycle.request_finished()
+
 # Health check endpoint
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({'status': 'healthy'}), 200
 
+# Readiness for the load balancer, distinct from the /api/health liveness check
+@app.route('/api/ready', methods=['GET'])
+def readiness_check():
+    init_error = None
+    try:
+        HealthAssistant()
+        if not lifecycle.warm:
+            lifecycle.mark_warm()
+    except Exception as e:
+        init_error = str(e)
+
+    # Cached background probe results; an upstream not probed yet does not block readiness
+    upstreams = prober.results()
+    ready = (
+        init_error is None
+        and not lifecycle.draining
+        and all(upstreams[name]["reachable"] is not False for name in CRITICAL_UPSTREAMS)
+    )
+    return jsonify({
+        "status": "ready" if ready else "not_ready",
+        "initialization_error": init_error,
+        "worker": lifecycle.snapshot(),
+        "upstreams": upstreams
+    }), 200 if ready else 503
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Expose admission control state (rate limits, provider slots, queue depth)"""
+    assistant = HealthAssistant()
+    return jsonify({
+        "status": "success",
+        "admission": admission.snapshot(),
+        "generation": assistant.generation_policy.stats.snapshot(),
+        "titles_dropped": assistant.titles_dropped,
+        "analytics": assistant.analytics.stats() if assistant.analytics else None,
+        "answer_index": assistant.answer_index.stats(),
+        "worker": lifecycle.snapshot()
+    })
+
+@app.route('/api/diagnostics', methods=['GET'])
+def diagnostics():
+    """Deep health report: initialization, upstream probes, latencies, queues and caches.
+
+    Only reads cached state, so it is cheap enough to poll frequently.
+    """
+    init_error = None
+    assistant = None
+    try:
+        assistant = HealthAssistant()
+    except Exception as e:
+        init_error = str(e)
+
+    upstreams = prober.results()
+    caches = {"citation_urls": normalize_url.cache_info()._asdict()}
+    if assistant is not None:
+        caches["conversation_context"] = assistant.context_builder.stats()
+        caches["answer_index"] = assistant.answer_index.stats()
+
+    if init_error:
+        status = "unhealthy"
+    elif lifecycle.draining or any(result["reachable"] is False for result in upstreams.values()):
+        status = "degraded"
+    else:
+        status = "ok"
+
+    return jsonify({
+        "status": status,
+        "initialization": {"ok": init_error is None, "error": init_error},
+        "upstreams": upstreams,
+        "latency": latency.snapshot(),
+        "queues": {
+            "admission_depth": admission.queue_depth(),
+            "admission": admission.snapshot(),
+            "analytics": assistant.analytics.stats() if assistant and assistant.analytics else None
+        },
+        "caches": caches,
+        "worker": lifecycle.snapshot(),
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }), 503 if init_error else 200
+
 @app.route('/api/profile/personal', methods=['POST'])
+@admission_controlled("openai")
 def process_personal_info():
     try:
         data = request.get_json()
@@ -899,6 +1637,7 @@ def process_personal_info():
         }), 500
 
 @app.route('/api/profile/medical', methods=['POST'])
+@admission_controlled("openai")
 def process_medical_info():
     try:
         data = request.get_json()
@@ -931,7 +1670,7 @@ def process_medical_info():
 def get_chat_history():
     try:
         assistant = HealthAssistant()
-        history = assistant.get_chat_history()
+        history = assistant.get_conversation_history(_session_id())
         
         return jsonify({
             "status": "success",
@@ -944,27 +1683,152 @@ def get_chat_history():
             "message": str(e)
         }), 500
 
+@app.route('/api/analytics/export', methods=['GET'])
+def export_analytics():
+    """Stream chat turns or food analyses as CSV (default) or Arrow IPC for offline analysis"""
+    if not _admin_authorized():
+        return jsonify({
+            "status": "error",
+            "message": "Unauthorized"
+        }), 403
+
+    try:
+        assistant = HealthAssistant()
+        if not assistant.analytics:
+            return jsonify({
+                "status": "error",
+                "message": "Analytics store is disabled"
+            }), 404
+
+        table = request.args.get('table', 'chat_turns')
+        export_format = request.args.get('format', 'csv')
+        since = request.args.get('since', type=float)
+
+        if export_format == 'arrow':
+            chunks = assistant.analytics.export_arrow(table, since)
+            mimetype = 'application/vnd.apache.arrow.stream'
+        else:
+            chunks = assistant.analytics.export_csv(table, since)
+            mimetype = 'text/csv'
+
+        # Pull the first chunk so bad parameters surface as a 400 rather than a broken stream
+        first = next(chunks, None)
+
+        def generate():
+            if first is not None:
+                yield first
+            yield from chunks
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={table}.{export_format}'}
+        )
+
+    except (ValueError, RuntimeError) as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Error in export_analytics: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@app.route('/api/admin/profiles', methods=['GET'])
+@app.route('/api/admin/profiles/<profile_id>', methods=['GET'])
+def get_request_profile(profile_id=None):
+    """cProfile output of a request captured with X-Profile: 1 (held by the worker that served it)"""
+    if not _admin_authorized():
+        return jsonify({
+            "status": "error",
+            "message": "Unauthorized"
+        }), 403
+
+    if profile_id is None:
+        return jsonify({"status": "success", "profiles": request_profiler.recent()})
+    capture = request_profiler.get(profile_id)
+    if capture is None:
+        return jsonify({
+            "status": "error",
+            "message": "Profile not found in this worker"
+        }), 404
+    return jsonify({"status": "success", "profile": capture})
+
+@app.route('/api/admin/profiler', methods=['GET', 'POST'])
+def sampling_profiler():
+    """Toggle the sampling profiler of this worker and fetch collapsed stacks.
+
+    POST {"action": "start", "interval_ms": 10, "duration_seconds": 30} or {"action": "stop"}.
+    GET returns collapsed stacks as text (flamegraph.pl / speedscope input),
+    or the profiler state with ?format=json.
+    """
+    if not _admin_authorized():
+        return jsonify({
+            "status": "error",
+            "message": "Unauthorized"
+        }), 403
+
+    if request.method == 'GET':
+        if request.args.get('format') == 'json':
+            return jsonify({"status": "success", "profiler": sampler.snapshot()})
+        return Response(sampler.collapsed(), mimetype='text/plain')
+
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    if action == 'start':
+        interval_ms = data.get('interval_ms')
+        started = sampler.start(
+            interval=interval_ms / 1000.0 if interval_ms else None,
+            duration=data.get('duration_seconds'),
+            include_idle=bool(data.get('include_idle', False))
+        )
+        if not started:
+            return jsonify({
+                "status": "error",
+                "message": "Profiler is already running"
+            }), 409
+    elif action == 'stop':
+        sampler.stop()
+    else:
+        return jsonify({
+            "status": "error",
+            "message": "action must be 'start' or 'stop'"
+        }), 400
+    return jsonify({"status": "success", "profiler": sampler.snapshot()})
+
+# Serialized (and compressed) once at import instead of on every request
+PERSONAS_PAYLOAD = StaticPayload({
+    "status": "success",
+    "personas": [
+        {
+            "id": "glp1",
+            "name": "GLP-1 Specialist",
+            "description": "Specialized in GLP-1 medications and related topics"
+        },
+        {
+            "id": "general_med",
+            "name": "General Medical Assistant",
+            "description": "Knowledgeable about general medication-related queries"
+        }
+    ]
+})
+
 @app.route('/api/personas', methods=['GET'])
 def get_personas():
     """Return available personas"""
-    return jsonify({
-        "status": "success",
-        "personas": [
-            {
-                "id": "glp1",
-                "name": "GLP-1 Specialist",
-                "description": "Specialized in GLP-1 medications and related topics"
-            },
-            {
-                "id": "general_med",
-                "name": "General Medical Assistant",
-                "description": "Knowledgeable about general medication-related queries"
-            }
-        ]
-    })
+    body, encoding = PERSONAS_PAYLOAD.encoded(negotiate_encoding(request.headers.get('Accept-Encoding')))
+    response = Response(body, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
 
 # Update the chat endpoint to support streaming
 @app.route('/api/chat/stream', methods=['POST'])
+@admission_controlled("perplexity", priority=_is_priority_request)
 def chat_stream():
     try:
         data = request.get_json()
@@ -978,20 +1842,16 @@ def chat_stream():
             }), 400
 
         assistant = HealthAssistant()
+        session_id = _session_id()
+        # Free the Perplexity slot as soon as the answer is complete, not after the trailing title
+        release = g.admission_ticket.release
 
         def generate():
-            for response in assistant.get_streaming_response(query, selected_persona):
+            for response in assistant.get_streaming_response(query, selected_persona, session_id,
+                                                             release=release):
                 yield f"data: {response}\n\n"
 
-        return Response(
-            stream_with_context(generate()),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'X-Accel-Buffering': 'no'
-            }
-        )
+        return _stream_response(generate())
 
     except Exception as e:
         logger.error(f"Error in chat_stream endpoint: {str(e)}")
@@ -1000,6 +1860,32 @@ def chat_stream():
             "message": str(e)
         }), 500
 
+@sock.route('/api/chat/ws')
+def chat_ws(ws):
+    """One connection carries many concurrent chat turns; see ChatChannel for the protocol"""
+    client_keys = client_keys_for(request.headers, request.remote_addr)
+
+    def admit(query: str, persona: str):
+        # Same limits as /api/chat/stream, applied per turn rather than per connection
+        return admission.admit(client_keys, ("perplexity",), priority=_is_cheap_query(query, persona))
+
+    if not lifecycle.open_websocket(WS_MAX_CONNECTIONS):
+        ws.send(json.dumps({"status": "error", "message": "Too many connections, retry later"}))
+        ws.close(reason=1013, message="Try again later")
+        return
+
+    try:
+        channel = ChatChannel(ws, HealthAssistant(), admit, _session_id(), max_inflight=WS_MAX_INFLIGHT)
+        try:
+            # Returns after in-flight turns finish once the worker starts draining
+            channel.serve(draining=lambda: lifecycle.draining)
+        finally:
+            # Aborts the upstream streams of turns still in flight when the client goes away
+            channel.close()
+    finally:
+        lifecycle.close_websocket()
+
 if __name__ == '__main__':
+    # Development server only; use serve.py in production
     print("Starting Flask server on http://localhost:5000")
     app.run(host='0.0.0.0', port=5000, debug=True)
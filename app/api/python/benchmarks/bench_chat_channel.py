@@ -0,0 +1,106 @@
+"""Turn latency: WebSocket chat channel vs the /api/chat/stream SSE endpoint.
+
+    cd app/api/python && python -m benchmarks.bench_chat_channel [--turns N] [--tokens N] [--token-delay-ms N]
+
+Both paths run in-process against the real HealthAssistant with requests.post
+replaced by a canned Perplexity stream, so the numbers are the server-side
+cost per turn: routing, admission, request parsing and SSE framing on one
+side, a JSON frame per event on a long-lived channel on the other. Network
+and proxy costs (TLS and HTTP setup per SSE turn) are not included and only
+widen the gap in production.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+os.environ.setdefault("PPLX_API_KEY", "bench")
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+os.environ["ANALYTICS_ENABLED"] = "false"
+os.environ["DIAGNOSTICS_PROBES"] = "off"
+os.environ.setdefault("ADMISSION_RATE_PER_MINUTE", "1000000")
+os.environ.setdefault("ADMISSION_BURST", "1000000")
+
+import app as app_module  # noqa: E402
+from chat_channel import InProcessClient  # noqa: E402
+
+
+class CannedStream:
+    def __init__(self, tokens: int, delay: float):
+        self.tokens = tokens
+        self.delay = delay
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self):
+        for i in range(self.tokens):
+            if self.delay:
+                time.sleep(self.delay)
+            yield ("data: " + json.dumps({"choices": [{"delta": {"content": f"token{i} "}}]})).encode()
+
+    def close(self):
+        pass
+
+
+def sse_turn(client, query: str):
+    started = time.perf_counter()
+    first = None
+    response = client.post('/api/chat/stream', json={"query": query, "persona": "glp1"}, buffered=False)
+    for chunk in response.response:
+        if first is None and b'"streaming"' in chunk:
+            first = time.perf_counter() - started
+    response.close()
+    return first, time.perf_counter() - started
+
+
+def ws_turn(client, request_id: str, query: str):
+    started = time.perf_counter()
+    first = None
+    client.send({"type": "chat", "request_id": request_id, "query": query, "persona": "glp1"})
+    while True:
+        message = client.receive(timeout=30)
+        if first is None and message["status"] == "streaming":
+            first = time.perf_counter() - started
+        if message["status"] in ("complete", "error"):
+            return first, time.perf_counter() - started
+
+
+def report(label: str, samples) -> None:
+    firsts = [first * 1000 for first, _ in samples]
+    totals = [total * 1000 for _, total in samples]
+    print(f"  {label:<6} first token p50 {statistics.median(firsts):7.2f} ms   "
+          f"turn p50 {statistics.median(totals):7.2f} ms   p95 {sorted(totals)[int(len(totals) * 0.95) - 1]:7.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--token-delay-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    app_module.requests.post = lambda *a, **k: CannedStream(args.tokens, args.token_delay_ms / 1000.0)
+    assistant = app_module.HealthAssistant()
+    assistant.refine_titles = False
+
+    queries = [f"How should I store semaglutide pens, case {i}?" for i in range(args.turns)]
+    http = app_module.app.test_client()
+    channel = InProcessClient(assistant)
+    # Warm both paths (imports, first-request setup) before timing
+    sse_turn(http, queries[0])
+    ws_turn(channel, "warmup", queries[0])
+
+    sse = [sse_turn(http, query) for query in queries]
+    ws = [ws_turn(channel, f"r{i}", query) for i, query in enumerate(queries)]
+    channel.close()
+
+    print(f"{args.turns} sequential turns, {args.tokens} tokens each, {args.token_delay_ms} ms/token upstream")
+    report("SSE", sse)
+    report("WS", ws)
+
+
+if __name__ == '__main__':
+    main()
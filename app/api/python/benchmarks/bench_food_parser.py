@@ -0,0 +1,51 @@
+"""Parse cost per food analysis response, by upstream chunk size.
+
+    cd app/api/python && python -m benchmarks.bench_food_parser [--repeat N]
+
+The response is a typical Gemini answer in the Category / Confidence /
+Analysis format. The streamed rows feed FoodAnalysisStreamParser chunk by
+chunk as /api/calculator/stream does; the last row is the one-shot
+parse_food_analysis used by the non-streaming endpoints.
+"""
+import argparse
+import time
+
+from food_parser import FoodAnalysisStreamParser, parse_food_analysis
+
+RESPONSE = (
+    "**Category:** **Borderline**\n**Confidence:** 85 %\n**Analysis:**\n"
+    "White rice with a fried egg.\nModerate portion.\n"
+    + "Detailed nutritional breakdown of the plate.\n" * 40
+)
+
+
+def stream(text: str, chunk_size: int) -> None:
+    parser = FoodAnalysisStreamParser()
+    for position in range(0, len(text), chunk_size):
+        parser.feed(text[position:position + chunk_size])
+    parser.close()
+    parser.result()
+
+
+def timed(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    repeat = parser.parse_args().repeat
+
+    print(f"food analysis response ({len(RESPONSE)} chars)")
+    for chunk_size in (1, 16, 128, len(RESPONSE)):
+        micros = timed(lambda: stream(RESPONSE, chunk_size), repeat)
+        print(f"  {'streamed, chunk=' + str(chunk_size):<28} {micros:9.1f} us/response")
+    micros = timed(lambda: parse_food_analysis(RESPONSE), repeat)
+    print(f"  {'parse_food_analysis':<28} {micros:9.1f} us/response")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Bytes and CPU per response: stdlib jsonify vs orjson, raw vs gzip/br bodies.
+
+    cd app/api/python && python -m benchmarks.bench_response_encoding [--repeat N]
+
+Payloads are shaped like a /api/chat response with a 20-turn history and an
+/api/chat/stream answer of ~400 SSE token events. Compression of the SSE
+body uses compress_stream, i.e. with the per-event flush the server does.
+"""
+import argparse
+import json
+import time
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+from response_encoding import ORJSONProvider, brotli, compress_bytes, compress_stream, orjson
+
+ANSWER = (
+    "GLP-1 receptor agonists such as semaglutide slow gastric emptying and reduce appetite [[1]](#1). "
+    "Common side effects include nausea, vomiting and constipation, which usually ease after the first "
+    "few weeks of a dose step [[2]](#2). Always follow the titration schedule from your prescriber. "
+) * 8
+
+
+def chat_payload() -> dict:
+    turn = {
+        "id": "9f1c2b7e4d5a4c3b8e6f0a1b2c3d4e5f",
+        "query": "What are the common side effects of semaglutide?",
+        "response": ANSWER,
+        "persona": "glp1",
+        "title": "Semaglutide side effects",
+        "timestamp": "2026-10-19 12:00:00"
+    }
+    return {
+        "status": "success",
+        "id": turn["id"],
+        "query": turn["query"],
+        "query_category": "side_effects",
+        "response": ANSWER,
+        "citations": [
+            {"n": 1, "title": "FDA label", "url": "https://www.accessdata.fda.gov/drugsatfda_docs/label/ozempic.pdf"},
+            {"n": 2, "title": "NEJM", "url": "https://www.nejm.org/doi/full/10.1056/NEJMoa2032183"}
+        ],
+        "persona": "glp1",
+        "title": turn["title"],
+        "disclaimer": "Always consult your healthcare provider before making any changes to your medication or treatment plan.",
+        "timestamp": turn["timestamp"],
+        "conversation_history": [dict(turn, id=f"{i:032x}") for i in range(20)]
+    }
+
+
+def sse_events() -> list:
+    words = ANSWER.split(" ")
+    events = [
+        "data: " + json.dumps({"status": "streaming", "content": word + " ", "persona": "glp1"}) + "\n\n"
+        for word in words
+    ]
+    events.append("data: " + json.dumps({"status": "complete", "full_response": ANSWER, "persona": "glp1"}) + "\n\n")
+    return events
+
+
+def timed(fn, repeat: int):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - started) / repeat * 1e6
+
+
+def row(label: str, size: int, micros: float, baseline: int) -> None:
+    print(f"  {label:<28} {size:>9,d} B  {size / baseline:6.1%}  {micros:9.1f} us")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    repeat = parser.parse_args().repeat
+
+    payload = chat_payload()
+    app = Flask(__name__)
+    stdlib = DefaultJSONProvider(app)
+    fast = ORJSONProvider(app)
+
+    with app.app_context():
+        # jsonify() is app.json.response(); compare the full Response construction
+        stdlib_body, stdlib_us = timed(lambda: stdlib.response(payload).get_data(), repeat)
+        fast_body, fast_us = timed(lambda: fast.response(payload).get_data(), repeat)
+
+    print(f"/api/chat response ({'orjson' if orjson else 'orjson not installed, stdlib fallback'})")
+    row("jsonify (stdlib json)", len(stdlib_body), stdlib_us, len(stdlib_body))
+    row("jsonify (ORJSONProvider)", len(fast_body), fast_us, len(stdlib_body))
+    encodings = ["gzip"] + (["br"] if brotli else [])
+    for encoding in encodings:
+        body, micros = timed(lambda: compress_bytes(fast_body, encoding), repeat)
+        row(f"{encoding} (dynamic level)", len(body), micros, len(stdlib_body))
+
+    events = sse_events()
+    raw = "".join(events).encode("utf-8")
+    print(f"/api/chat/stream answer ({len(events)} events)")
+    row("raw", len(raw), 0.0, len(raw))
+    for encoding in encodings:
+        body, micros = timed(lambda: b"".join(compress_stream(events, encoding)), max(1, repeat // 10))
+        row(f"{encoding} (flush per event)", len(body), micros, len(raw))
+
+
+if __name__ == '__main__':
+    main()
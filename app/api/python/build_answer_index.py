@@ -0,0 +1,113 @@
+"""Offline build step for the precomputed answer index.
+
+    python build_answer_index.py generate   # draft answers into answer_index.candidates.json
+    python build_answer_index.py publish    # copy reviewed candidates into answer_index.json
+
+After `generate`, a reviewer reads each candidate, edits the answer or
+citations if needed and sets "reviewed": true. `publish` writes only reviewed
+entries, bumps the version and replaces the index file atomically so running
+workers pick it up on their next reload check.
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+from typing import Dict, Any
+
+from answer_index import query_key
+from citations import process_citations
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _load(path: str, default: Dict[str, Any]) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_atomic(path: str, data: Dict[str, Any]) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+    os.replace(tmp_path, path)
+
+
+def generate(questions_path: str, candidates_path: str, force: bool) -> None:
+    from app import HealthAssistant
+
+    assistant = HealthAssistant()
+    questions = _load(questions_path, {"questions": []})["questions"]
+    existing = {entry["id"]: entry for entry in _load(candidates_path, {"entries": []})["entries"]}
+
+    entries = []
+    for question in questions:
+        previous = existing.get(question["id"])
+        if previous and previous.get("reviewed") and not force:
+            # Keep reviewed answers, but pick up edits to the variants list
+            entries.append({**previous, "variants": question.get("variants", [])})
+            continue
+
+        persona = question.get("personas", ["glp1"])[0]
+        category = assistant.categorize_query(question["question"])
+        if category != question["category"]:
+            print(f"warning: {question['id']} categorizes as {category}, not {question['category']}", file=sys.stderr)
+
+        print(f"generating {question['id']}", file=sys.stderr)
+        answer = assistant.request_completion(question["question"], assistant.new_context(persona), category)
+        # Same normalization as live answers, so indexed answers render identically
+        answer, citations = process_citations(answer)
+        entries.append({
+            **question,
+            "answer": answer.strip(),
+            "citations": citations,
+            "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "reviewed": False
+        })
+
+    _write_atomic(candidates_path, {"entries": entries})
+    print(f"wrote {len(entries)} candidates to {candidates_path}; review them before publishing", file=sys.stderr)
+
+
+def publish(candidates_path: str, index_path: str) -> None:
+    candidates = _load(candidates_path, {"entries": []})["entries"]
+    reviewed = [entry for entry in candidates if entry.get("reviewed")]
+
+    keys: Dict[str, str] = {}
+    for entry in reviewed:
+        for question in [entry["question"]] + entry.get("variants", []):
+            key = query_key(question)
+            if key in keys and keys[key] != entry["id"]:
+                raise SystemExit(f"'{question}' in {entry['id']} collides with {keys[key]}")
+            keys[key] = entry["id"]
+
+    current = _load(index_path, {"version": 0})
+    version = int(current.get("version") or 0) + 1
+    _write_atomic(index_path, {
+        "version": version,
+        "built_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "entries": reviewed
+    })
+    print(f"published version {version} with {len(reviewed)} of {len(candidates)} candidates", file=sys.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["generate", "publish"])
+    parser.add_argument("--questions", default=os.path.join(HERE, "answer_index_questions.json"))
+    parser.add_argument("--candidates", default=os.path.join(HERE, "answer_index.candidates.json"))
+    parser.add_argument("--index", default=os.getenv('ANSWER_INDEX_PATH', os.path.join(HERE, "answer_index.json")))
+    parser.add_argument("--force", action="store_true", help="regenerate reviewed candidates too")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        generate(args.questions, args.candidates, args.force)
+    else:
+        publish(args.candidates, args.index)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import json
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, Optional
+
+from admission import AdmissionRejected
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelClosed(Exception):
+    """The client side of an in-process connection went away"""
+
+
+class ChatChannel:
+    """Multiplexes chat turns from one WebSocket connection.
+
+    Client messages (JSON text frames):
+        {"type": "chat", "request_id": "r1", "query": "...", "persona": "glp1", "session_id": "s1"}
+        {"type": "cancel", "request_id": "r1"}
+        {"type": "history", "session_id": "s1"}
+        {"type": "ping"}
+
+    Server messages are the events of HealthAssistant.get_streaming_response
+    ("streaming", "complete", "title", "cancelled", "error") tagged with the
+    request_id they belong to, plus "pong" and "history" pushes after every
+    completed turn that has a session_id (anonymous turns keep no history).
+    Turns run concurrently on a small per-connection pool; frames of
+    different turns interleave on the socket.
+    """
+
+    def __init__(self, ws, assistant, admit: Optional[Callable[[str, str], Any]] = None,
+                 session_id: Optional[str] = None, max_inflight: int = 4):
+        self.ws = ws
+        self.assistant = assistant
+        self.admit = admit
+        self.session_id = session_id
+        self.max_inflight = max_inflight
+        self._active: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="ws-chat")
+        self._closed = False
+
+    def send(self, message: Dict[str, Any]) -> None:
+        if self._closed:
+            return
+        with self._send_lock:
+            self.ws.send(json.dumps(message))
+
+    def serve(self, draining: Callable[[], bool] = lambda: False, poll: float = 1.0) -> None:
+        """Read client messages until the connection closes or the worker starts draining.
+
+        On drain, new turns are refused while in-flight turns finish, then
+        serve() returns so the caller can close the connection.
+        """
+        while True:
+            if draining():
+                self.send({"status": "draining", "message": "Server is restarting, please reconnect"})
+                self._executor.shutdown(wait=True)
+                return
+            try:
+                raw = self.ws.receive(timeout=poll)
+            except ChannelClosed:
+                return
+            if raw is None:
+                continue
+            try:
+                message = json.loads(raw)
+                if not isinstance(message, dict):
+                    raise ValueError("Message must be a JSON object")
+            except ValueError as e:
+                self.send({"status": "error", "message": f"Invalid message: {str(e)}"})
+                continue
+            self.handle(message)
+
+    def handle(self, message: Dict[str, Any]) -> None:
+        kind = message.get("type")
+        request_id = message.get("request_id")
+        if kind == "chat":
+            self._start_chat(request_id, message)
+        elif kind == "cancel":
+            with self._lock:
+                cancel = self._active.get(request_id)
+            if cancel is None:
+                self.send({"status": "error", "request_id": request_id, "message": "Unknown request_id"})
+            else:
+                cancel.set()
+        elif kind == "history":
+            self._push_history(message.get("session_id") or self.session_id, request_id)
+        elif kind == "ping":
+            self.send({"status": "pong", "request_id": request_id})
+        else:
+            self.send({"status": "error", "request_id": request_id, "message": f"Unknown message type: {kind}"})
+
+    def _start_chat(self, request_id: Optional[str], message: Dict[str, Any]) -> None:
+        query = message.get("query")
+        if not request_id or not query:
+            self.send({"status": "error", "request_id": request_id, "message": "request_id and query are required"})
+            return
+        with self._lock:
+            if request_id in self._active:
+                error = "request_id is already in use"
+            elif len(self._active) >= self.max_inflight:
+                error = f"At most {self.max_inflight} concurrent requests per connection"
+            else:
+                error = None
+                self._active[request_id] = threading.Event()
+        if error:
+            self.send({"status": "error", "request_id": request_id, "message": error})
+            return
+        self._executor.submit(
+            self._run_chat,
+            request_id,
+            query,
+            message.get("persona", "general_med"),
+            message.get("session_id") or self.session_id
+        )
+
+    def _run_chat(self, request_id: str, query: str, persona: str, session_id: Optional[str]) -> None:
+        ticket = None
+        try:
+            if self.admit:
+                ticket = self.admit(query, persona)
+            cancel = self._active[request_id]
+            for event in self.assistant.get_streaming_response(
+                    query, persona, session_id, cancel=cancel, release=ticket.release if ticket else None):
+                payload = json.loads(event)
+                payload["request_id"] = request_id
+                self.send(payload)
+                if payload.get("status") == "complete" and session_id:
+                    self._push_history(session_id, request_id)
+        except AdmissionRejected as e:
+            self.send({
+                "status": "error",
+                "request_id": request_id,
+                "message": e.reason,
+                "retry_after": e.retry_after_header
+            })
+        except Exception as e:
+            logger.error(f"Error in websocket chat: {str(e)}")
+            self.send({"status": "error", "request_id": request_id, "message": str(e)})
+        finally:
+            if ticket is not None:
+                ticket.release()
+            with self._lock:
+                self._active.pop(request_id, None)
+
+    def _push_history(self, session_id: Optional[str], request_id: Optional[str] = None) -> None:
+        self.send({
+            "status": "history",
+            "request_id": request_id,
+            "session_id": session_id,
+            "conversation_history": self.assistant.get_conversation_history(session_id)
+        })
+
+    def close(self) -> None:
+        """Cancel in-flight turns (closing their upstream streams) and stop sending"""
+        with self._lock:
+            for cancel in self._active.values():
+                cancel.set()
+        self._closed = True
+        self._executor.shutdown(wait=False)
+
+
+class InProcessClient:
+    """Drives a ChatChannel over in-memory queues, without a network or server.
+
+        client = InProcessClient(HealthAssistant())
+        client.send({"type": "chat", "request_id": "r1", "query": "..."})
+        event = client.receive(timeout=30)
+    """
+
+    def __init__(self, assistant, draining: Callable[[], bool] = lambda: False, **channel_options):
+        self._draining = draining
+        self._to_server: "queue.Queue" = queue.Queue()
+        self._to_client: "queue.Queue" = queue.Queue()
+        self.channel = ChatChannel(_QueueSocket(self._to_server, self._to_client), assistant, **channel_options)
+        self._thread = threading.Thread(target=self._serve, name="ws-in-process", daemon=True)
+        self._thread.start()
+
+    def _serve(self) -> None:
+        try:
+            self.channel.serve(self._draining, poll=0.05)
+        finally:
+            self.channel.close()
+
+    def send(self, message: Dict[str, Any]) -> None:
+        self._to_server.put(json.dumps(message))
+
+    def receive(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Next server message; raises queue.Empty on timeout"""
+        return json.loads(self._to_client.get(timeout=timeout))
+
+    def close(self) -> None:
+        self._to_server.put(None)
+        self._thread.join(timeout=5)
+
+
+class _QueueSocket:
+    """The send/receive subset of a flask-sock connection, backed by queues"""
+
+    def __init__(self, incoming: "queue.Queue", outgoing: "queue.Queue"):
+        self._incoming = incoming
+        self._outgoing = outgoing
+
+    def receive(self, timeout: Optional[float] = None):
+        """Like flask-sock: None on timeout, an exception once the peer has closed"""
+        try:
+            data = self._incoming.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if data is None:
+            raise ChannelClosed()
+        return data
+
+    def send(self, data: str) -> None:
+        self._outgoing.put(data)
@@ -0,0 +1,175 @@
+import re
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+# [3], [[3]], [3](#3) and the canonical [[3]](#3), also glued to a word as in "helps[3]";
+# not a numbered link such as [1](https://...) or an index such as [0], since sources start at 1
+_INLINE_PATTERN = re.compile(r"\[\[?([1-9]\d{0,2})\]?\](?:(\(#\d{1,3}\))|(?!\((?!#)))")
+# Anything that could still grow into an inline citation with more input
+_INLINE_PREFIX_PATTERN = re.compile(r"\[\[?([1-9]\d{0,2}(\]\]?(\(#?\d{0,3})?)?)?$")
+_SOURCES_HEADER_PATTERN = re.compile(r"^\s*(#+\s*)?\**\s*(sources|references)\s*:?\s*\**\s*:?\s*$", re.IGNORECASE)
+_SOURCE_LINK_PATTERN = re.compile(r"^(\s*)(?:[-*]\s*)?\[?(\d{1,3})?[.)\]]?\s*\[([^\]]+)\]\((\S+?)\)[.,;]?\s*$")
+_SOURCE_BARE_PATTERN = re.compile(r"^(\s*)(?:[-*]\s*)?\[?(\d{1,3})?[.)\]]?\s*(?:(.+?)\s*[:\-–]\s*)?<?(https?://[^\s>]+)>?\s*$")
+
+# Longest text held back while deciding whether it is a citation
+_MAX_PENDING = 16
+_MAX_HEADER_LINE = 40
+
+
+@lru_cache(maxsize=4096)
+def normalize_url(url: str) -> str:
+    """Canonical form of a source URL: trimmed, lowercase host, no tracking params or fragment"""
+    url = url.strip().rstrip(".,;)")
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    if not parts.scheme or not parts.netloc:
+        return url
+    query = urlencode([
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_")
+    ])
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", query, ""))
+
+
+class CitationStreamProcessor:
+    """Single-pass state machine that normalizes citations while an answer streams.
+
+    Inline citations in any of the common malformed shapes are rewritten to
+    [[n]](#n) and renumbered by first appearance, so gaps disappear. Once a
+    "Sources" header line is seen, each following line is parsed as a source
+    and rewritten with the new number; the block is re-emitted in numeric
+    order when the stream closes. Body text is held back only while it could
+    still be a citation, which is at most a few characters.
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self._line = ""
+        self._in_sources = False
+        self._source_line = ""
+        self._unparsed_sources: List[str] = []
+        self._numbers: Dict[int, int] = {}
+        self._next_number = 1
+        self._sources: Dict[int, Dict[str, Any]] = {}
+
+    def _renumber(self, original: Optional[int]) -> int:
+        """Map a model-provided number to its sequential number by first appearance"""
+        if original is not None and original in self._numbers:
+            return self._numbers[original]
+        new = self._next_number
+        self._next_number += 1
+        if original is not None:
+            self._numbers[original] = new
+        return new
+
+    def feed(self, chunk: str) -> str:
+        """Consume a chunk and return the normalized text that can be emitted now"""
+        if self._in_sources:
+            return self._feed_sources(chunk)
+
+        data = self._pending + chunk
+        self._pending = ""
+        out: List[str] = []
+        i = 0
+        while i < len(data):
+            if self._in_sources:
+                out.append(self._feed_sources(data[i:]))
+                break
+            bracket = data.find('[', i)
+            newline = data.find('\n', i)
+            if newline != -1 and (bracket == -1 or newline < bracket):
+                out.append(data[i:newline + 1])
+                self._end_line(data[i:newline])
+                i = newline + 1
+                continue
+            if bracket == -1:
+                out.append(data[i:])
+                self._extend_line(data[i:])
+                break
+
+            out.append(data[i:bracket])
+            self._extend_line(data[i:bracket])
+            rest = data[bracket:]
+            if len(rest) < _MAX_PENDING and _INLINE_PREFIX_PATTERN.match(rest):
+                self._pending = rest
+                break
+            match = _INLINE_PATTERN.match(data, bracket)
+            if match:
+                number = self._renumber(int(match.group(1)))
+                citation = f"[[{number}]](#{number})"
+                out.append(citation)
+                self._extend_line(citation)
+                i = match.end()
+                continue
+            out.append('[')
+            self._extend_line('[')
+            i = bracket + 1
+        return "".join(out)
+
+    def close(self) -> str:
+        """Flush held-back text at the end of the stream"""
+        out = ""
+        if self._pending:
+            pending, self._pending = self._pending, ""
+            match = _INLINE_PATTERN.fullmatch(pending)
+            if match:
+                number = self._renumber(int(match.group(1)))
+                out = f"[[{number}]](#{number})"
+            else:
+                out = pending
+        if self._source_line:
+            line, self._source_line = self._source_line, ""
+            self._parse_source(line)
+        if self._in_sources:
+            lines = [f"{c['n']}. [{c['title']}]({c['url']})" for c in self.citations]
+            out += "\n".join(lines + self._unparsed_sources)
+        return out
+
+    def _extend_line(self, text: str) -> None:
+        if len(self._line) <= _MAX_HEADER_LINE:
+            self._line += text
+
+    def _end_line(self, text: str) -> None:
+        line = self._line + text
+        self._line = ""
+        if len(line) <= _MAX_HEADER_LINE and _SOURCES_HEADER_PATTERN.match(line):
+            self._in_sources = True
+
+    def _feed_sources(self, data: str) -> str:
+        """Collect complete source lines; they are emitted in order by close()"""
+        self._source_line += data
+        start = 0
+        while True:
+            newline = self._source_line.find('\n', start)
+            if newline == -1:
+                break
+            self._parse_source(self._source_line[start:newline])
+            start = newline + 1
+        self._source_line = self._source_line[start:]
+        return ""
+
+    def _parse_source(self, line: str) -> None:
+        match = _SOURCE_LINK_PATTERN.match(line) or _SOURCE_BARE_PATTERN.match(line)
+        if not match:
+            if line.strip():
+                self._unparsed_sources.append(line)
+            return
+        _, number, title, url = match.groups()
+        url = normalize_url(url)
+        title = (title or urlsplit(url).netloc).strip()
+        new = self._renumber(int(number) if number else None)
+        self._sources[new] = {"n": new, "title": title, "url": url}
+
+    @property
+    def citations(self) -> List[Dict[str, Any]]:
+        return [self._sources[n] for n in sorted(self._sources)]
+
+
+def process_citations(text: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """Normalize a complete answer. Returns (text, citations)."""
+    processor = CitationStreamProcessor()
+    normalized = processor.feed(text) + processor.close()
+    return normalized, processor.citations
@@ -0,0 +1,142 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken is optional; fall back to a regex estimate
+    _encoding = None
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_CITATION_PATTERN = re.compile(r"\[\[\d+\]\]\(#\d+\)")
+_SOURCES_PATTERN = re.compile(r"\n\s*\**Sources:?\**\s*\n.*", re.IGNORECASE | re.DOTALL)
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken when available, otherwise approximate by words and punctuation"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to at most `max_tokens`, preferring sentence boundaries"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    kept: List[str] = []
+    used = 0
+    for sentence in _SENTENCE_PATTERN.split(text):
+        cost = count_tokens(sentence)
+        if used + cost > max_tokens:
+            break
+        kept.append(sentence)
+        used += cost
+    if not kept:
+        if _encoding is not None:
+            return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max_tokens]) + "..."
+        return " ".join(text.split()[:max_tokens]) + "..."
+    return " ".join(kept) + " ..."
+
+
+class ConversationContextBuilder:
+    """Selects prior turns for an upstream prompt under a fixed token budget.
+
+    The most recent turns are kept close to verbatim; older answers are
+    condensed (citations and Sources blocks stripped, then truncated) and the
+    condensed form is cached so it is computed once per answer, not per turn.
+    """
+
+    def __init__(self, token_budget: int = 1200, recent_turns: int = 1,
+                 recent_turn_tokens: int = 500, summary_tokens: int = 120,
+                 max_turns_scanned: int = 20, cache_size: int = 1024):
+        self.token_budget = token_budget
+        self.recent_turns = recent_turns
+        self.recent_turn_tokens = recent_turn_tokens
+        self.summary_tokens = summary_tokens
+        self.max_turns_scanned = max_turns_scanned
+        self.cache_size = cache_size
+        self._summaries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    @classmethod
+    def from_env(cls) -> "ConversationContextBuilder":
+        return cls(
+            token_budget=int(os.getenv('CONTEXT_TOKEN_BUDGET', '1200')),
+            recent_turns=int(os.getenv('CONTEXT_RECENT_TURNS', '1')),
+            recent_turn_tokens=int(os.getenv('CONTEXT_RECENT_TURN_TOKENS', '500')),
+            summary_tokens=int(os.getenv('CONTEXT_SUMMARY_TOKENS', '120'))
+        )
+
+    def _condense(self, text: str, max_tokens: int) -> tuple:
+        """Return (condensed text, token count), cached by content and size"""
+        key = hashlib.sha1(f"{max_tokens}:{text}".encode('utf-8')).hexdigest()
+        with self._lock:
+            cached = self._summaries.get(key)
+            if cached is not None:
+                self._summaries.move_to_end(key)
+                self.cache_hits += 1
+                return cached
+            self.cache_misses += 1
+
+        condensed = _SOURCES_PATTERN.sub("", text)
+        condensed = _CITATION_PATTERN.sub("", condensed).strip()
+        condensed = truncate_to_tokens(condensed, max_tokens)
+        result = (condensed, count_tokens(condensed))
+
+        with self._lock:
+            self._summaries[key] = result
+            if len(self._summaries) > self.cache_size:
+                self._summaries.popitem(last=False)
+        return result
+
+    def select_turns(self, history: List[Dict[str, Any]], persona: Optional[str] = None,
+                     budget: Optional[int] = None) -> List[Dict[str, str]]:
+        """Pick the newest turns that fit the budget, returned oldest first"""
+        remaining = self.token_budget if budget is None else budget
+        selected: List[Dict[str, str]] = []
+        recent = history[-self.max_turns_scanned:]
+        for age, turn in enumerate(reversed(recent)):
+            if persona and turn.get("persona", persona) != persona:
+                continue
+            query, answer = turn.get("query", ""), turn.get("response", "")
+            if not query or not answer:
+                continue
+            limit = self.recent_turn_tokens if age < self.recent_turns else self.summary_tokens
+            query_text, query_tokens = self._condense(query, limit)
+            answer_text, answer_tokens = self._condense(answer, limit)
+            cost = query_tokens + answer_tokens
+            if cost > remaining:
+                break
+            remaining -= cost
+            selected.append({"query": query_text, "response": answer_text})
+        selected.reverse()
+        return selected
+
+    def build_messages(self, system_prompt: str, query: str, history: List[Dict[str, Any]],
+                       persona: Optional[str] = None) -> List[Dict[str, str]]:
+        """Build an alternating system/user/assistant message list ending with `query`"""
+        messages = [{"role": "system", "content": system_prompt}]
+        for turn in self.select_turns(history, persona):
+            messages.append({"role": "user", "content": turn["query"]})
+            messages.append({"role": "assistant", "content": turn["response"]})
+        messages.append({"role": "user", "content": query})
+        return messages
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                "token_budget": self.token_budget,
+                "tokenizer": "tiktoken" if _encoding is not None else "regex",
+                "cached_summaries": len(self._summaries),
+                "cache_hit_rate": round(self.cache_hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,154 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyTracker:
+    """Rolling latency and error counts per upstream provider"""
+
+    def __init__(self, window: int = 500):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._errors: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, seconds: float, ok: bool = True) -> None:
+        with self._lock:
+            self._samples.setdefault(provider, deque(maxlen=self.window)).append(seconds)
+            if not ok:
+                self._errors[provider] = self._errors.get(provider, 0) + 1
+
+    @contextmanager
+    def measure(self, provider: str):
+        started = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record(provider, time.monotonic() - started, ok)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = {provider: sorted(values) for provider, values in self._samples.items()}
+            errors = dict(self._errors)
+        report = {}
+        for provider, values in samples.items():
+            report[provider] = {
+                "count": len(values),
+                "p50_ms": round(_percentile(values, 50) * 1000, 1),
+                "p95_ms": round(_percentile(values, 95) * 1000, 1),
+                "errors": errors.get(provider, 0)
+            }
+        return report
+
+
+def _percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))]
+
+
+class ProbeFailed(Exception):
+    """Upstream answered with a server error"""
+
+    def __init__(self, status_code: int):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def _http_probe(url: str, headers: Optional[Dict[str, str]] = None, timeout: float = 5.0) -> Callable[[], None]:
+    """Probe that succeeds on any non-5xx response; no tokens are spent.
+
+    Credentials go in headers only: request URLs end up in exception messages.
+    """
+    def probe():
+        response = requests.get(url, headers=headers or {}, timeout=timeout)
+        if response.status_code >= 500:
+            raise ProbeFailed(response.status_code)
+    return probe
+
+
+def default_probes() -> Dict[str, Callable[[], None]]:
+    """Cheap upstream probes; DIAGNOSTICS_PROBES=off replaces them with no-op stubs for offline use"""
+    if os.getenv('DIAGNOSTICS_PROBES', 'on').lower() == 'off':
+        return {name: (lambda: None) for name in ("perplexity", "openai", "gemini")}
+    return {
+        # Perplexity has no free endpoint; a GET on the completions route answers 4xx when reachable
+        "perplexity": _http_probe("https://api.perplexity.ai/chat/completions"),
+        "openai": _http_probe(
+            "https://api.openai.com/v1/models",
+            {"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY', '')}"}
+        ),
+        "gemini": _http_probe(
+            "https://generativelanguage.googleapis.com/v1beta/models",
+            {"x-goog-api-key": os.getenv('GEMINI_API_KEY', '')}
+        )
+    }
+
+
+class UpstreamProber:
+    """Runs upstream probes on a background thread and caches the latest results.
+
+    Requests only ever read the cache. The thread is started lazily in each
+    process so it also runs in forked workers.
+    """
+
+    def __init__(self, probes: Dict[str, Callable[[], None]], interval: float = 30.0):
+        self.probes = probes
+        self.interval = interval
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def ensure_started(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="upstream-prober", daemon=True).start()
+
+    def _run(self) -> None:
+        while True:
+            self.probe_all()
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def probe_all(self) -> Dict[str, Dict[str, Any]]:
+        for name, probe in list(self.probes.items()):
+            started = time.monotonic()
+            try:
+                probe()
+                result = {"reachable": True}
+            except ProbeFailed as e:
+                result = {"reachable": False, "error": f"HTTP {e.status_code}"}
+            except Exception as e:
+                # Only the exception class: messages can echo request URLs and headers
+                result = {"reachable": False, "error": type(e).__name__}
+            result["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+            result["checked_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            self._results[name] = result
+        return self._results
+
+    def results(self) -> Dict[str, Dict[str, Any]]:
+        """Cached results; providers not probed yet are reported as unknown"""
+        self.ensure_started()
+        return {
+            name: self._results.get(name, {"reachable": None, "error": "not probed yet"})
+            for name in self.probes
+        }
+
+
+latency = LatencyTracker()
+prober = UpstreamProber(default_probes(), interval=float(os.getenv('DIAGNOSTICS_PROBE_INTERVAL', '30')))
@@ -0,0 +1,125 @@
+import re
+from typing import Dict, Any, List, Optional
+
+LABELS = ["Clearly Healthy", "Borderline", "Mixed", "Clearly Unhealthy"]
+
+_FIELD_PATTERN = re.compile(r"^[\s>*#_-]*(category|confidence|analysis)[\s*_]*[:\-][\s*_]*(.*)$", re.IGNORECASE)
+_NUMBER_PATTERN = re.compile(r"(\d+(?:[.,]\d+)?)\s*(%|percent)?", re.IGNORECASE)
+
+
+def normalize_category(raw: str) -> str:
+    """Map free-form model output such as '**clearly  healthy**.' onto one of LABELS"""
+    text = re.sub(r"[^a-z ]", " ", raw.lower())
+    text = " ".join(text.split())
+    # Longest labels first so "clearly unhealthy" never matches "healthy" variants
+    for label in sorted(LABELS, key=len, reverse=True):
+        if label.lower() in text:
+            return label
+    if "unhealthy" in text:
+        return "Clearly Unhealthy"
+    if "healthy" in text:
+        return "Clearly Healthy"
+    return raw.strip(" *_")
+
+
+def parse_confidence(raw: str) -> Optional[float]:
+    """Parse '85%', '85 %', '0.85', '85 percent' or '85/100' into a 0-100 score"""
+    match = _NUMBER_PATTERN.search(raw)
+    if not match:
+        return None
+    value = float(match.group(1).replace(',', '.'))
+    if value <= 1 and not match.group(2) and '/' not in raw:
+        value *= 100
+    return max(0.0, min(100.0, value))
+
+
+class FoodAnalysisStreamParser:
+    """Incremental parser for the 'Category / Confidence / Analysis' format.
+
+    Feed text chunks as they arrive. Each call returns the events that became
+    available: ('category', str), ('confidence', float) and ('analysis', str).
+    Work per chunk is linear in the chunk size; only the current partial line
+    is buffered until the Analysis section starts, after which text is passed
+    straight through.
+    """
+
+    def __init__(self):
+        self.category = ""
+        self.confidence: Optional[float] = None
+        self._buffer = ""
+        self._in_analysis = False
+        self._analysis: List[str] = []
+
+    def feed(self, chunk: str) -> List[tuple]:
+        events: List[tuple] = []
+        if self._in_analysis:
+            self._emit_analysis(chunk, events)
+            return events
+
+        self._buffer += chunk
+        while not self._in_analysis:
+            newline = self._buffer.find('\n')
+            if newline < 0:
+                break
+            line, self._buffer = self._buffer[:newline], self._buffer[newline + 1:]
+            self._parse_line(line, events)
+        if self._in_analysis and self._buffer:
+            rest, self._buffer = self._buffer, ""
+            self._emit_analysis(rest, events)
+        return events
+
+    def close(self) -> List[tuple]:
+        """Flush whatever is left once the upstream stream ends"""
+        events: List[tuple] = []
+        if self._buffer:
+            line, self._buffer = self._buffer, ""
+            self._parse_line(line, events)
+        return events
+
+    def _parse_line(self, line: str, events: List[tuple]) -> None:
+        match = _FIELD_PATTERN.match(line)
+        if not match:
+            if line.strip() and self.category and self.confidence is not None:
+                # Model skipped the 'Analysis:' header; treat the rest as analysis
+                self._in_analysis = True
+                self._emit_analysis(line + '\n', events)
+            return
+        field, value = match.group(1).lower(), match.group(2)
+        if field == "category" and not self.category:
+            self.category = normalize_category(value)
+            events.append(("category", self.category))
+        elif field == "confidence" and self.confidence is None:
+            confidence = parse_confidence(value)
+            if confidence is not None:
+                self.confidence = confidence
+                events.append(("confidence", confidence))
+        elif field == "analysis":
+            self._in_analysis = True
+            if value.strip():
+                self._emit_analysis(value + '\n', events)
+
+    def _emit_analysis(self, text: str, events: List[tuple]) -> None:
+        if not self._analysis:
+            text = text.lstrip('\n')
+        if text:
+            self._analysis.append(text)
+            events.append(("analysis", text))
+
+    @property
+    def analysis(self) -> str:
+        return "\n".join(line.strip() for line in "".join(self._analysis).strip().split('\n'))
+
+    def result(self) -> Dict[str, Any]:
+        return {
+            "category": self.category,
+            "confidence": self.confidence if self.confidence is not None else 0,
+            "analysis": self.analysis
+        }
+
+
+def parse_food_analysis(text: str) -> Dict[str, Any]:
+    """Parse a complete Gemini response in one go"""
+    parser = FoodAnalysisStreamParser()
+    parser.feed(text)
+    parser.close()
+    return parser.result()
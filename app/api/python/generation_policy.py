@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+import threading
+from collections import deque
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+LARGE_MODEL = "llama-3.1-sonar-large-128k-online"
+SMALL_MODEL = "llama-3.1-sonar-small-128k-online"
+
+# Category -> generation settings. Simple factual categories get the lighter
+# model and a shorter budget; anything safety-sensitive keeps the large model.
+DEFAULT_POLICY = {
+    "default": {"model": LARGE_MODEL, "max_tokens": 1500, "temperature": 0.1},
+    "categories": {
+        "storage": {"model": SMALL_MODEL, "max_tokens": 600},
+        "cost": {"model": SMALL_MODEL, "max_tokens": 600},
+        "lifestyle": {"model": SMALL_MODEL, "max_tokens": 900},
+        "dosage": {"max_tokens": 1000},
+        "benefits": {"max_tokens": 1000},
+        "side_effects": {"max_tokens": 1200},
+        "interactions": {"max_tokens": 1500},
+        "general": {"max_tokens": 1200}
+    },
+    # Persona overrides are applied on top of the category settings,
+    # e.g. {"general_med": {"interactions": {"max_tokens": 1500}}}
+    "personas": {}
+}
+
+
+class GenerationPolicy:
+    """Maps (query category, persona) to model, max_tokens and temperature.
+
+    Overrides are read from GENERATION_POLICY (inline JSON) or
+    GENERATION_POLICY_FILE and merged over DEFAULT_POLICY.
+    """
+
+    def __init__(self, policy: Optional[Dict[str, Any]] = None):
+        self.policy = _merge(DEFAULT_POLICY, policy or {})
+        self.stats = GenerationStats()
+
+    @classmethod
+    def from_env(cls) -> "GenerationPolicy":
+        overrides: Dict[str, Any] = {}
+        try:
+            path = os.getenv('GENERATION_POLICY_FILE')
+            if path:
+                with open(path) as f:
+                    overrides = json.load(f)
+            elif os.getenv('GENERATION_POLICY'):
+                overrides = json.loads(os.getenv('GENERATION_POLICY'))
+        except Exception as e:
+            logger.error(f"Ignoring invalid generation policy override: {str(e)}")
+            overrides = {}
+        return cls(overrides)
+
+    def resolve(self, category: str, persona: str) -> Dict[str, Any]:
+        settings = dict(self.policy["default"])
+        settings.update(self.policy["categories"].get(category, {}))
+        settings.update(self.policy["personas"].get(persona, {}).get(category, {}))
+        return settings
+
+
+class GenerationStats:
+    """Rolling per-category latency and completion length, used to tune the policy"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, category: str, model: str, latency: float, completion_tokens: int) -> None:
+        with self._lock:
+            samples = self._samples.setdefault(category, deque(maxlen=self.window))
+            samples.append((latency, completion_tokens, model))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = {category: list(values) for category, values in self._samples.items()}
+        report = {}
+        for category, values in samples.items():
+            latencies = sorted(v[0] for v in values)
+            lengths = sorted(v[1] for v in values)
+            report[category] = {
+                "count": len(values),
+                "latency_p50": round(_percentile(latencies, 50), 3),
+                "latency_p95": round(_percentile(latencies, 95), 3),
+                "tokens_p50": _percentile(lengths, 50),
+                "tokens_max": lengths[-1],
+                "last_model": values[-1][2]
+            }
+        return report
+
+
+def _percentile(sorted_values, pct: float):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
+    merged = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
@@ -0,0 +1,70 @@
+import os
+import threading
+import time
+from typing import Dict, Any, Iterable, Iterator
+
+# Chat cannot work without these; a Gemini outage only affects food analysis
+CRITICAL_UPSTREAMS = ("perplexity", "openai")
+
+
+class Lifecycle:
+    """Per-worker process state used by the launcher and the readiness endpoint"""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.started_at = time.time()
+        self.warm = False
+        self.warm_error = None
+        self.draining = False
+        self.active_streams = 0
+        self.websockets = 0
+        self.requests_served = 0
+        self._lock = threading.Lock()
+
+    def mark_warm(self, error: Exception = None) -> None:
+        self.warm = error is None
+        self.warm_error = str(error) if error else None
+
+    def start_draining(self) -> None:
+        self.draining = True
+
+    def request_finished(self) -> None:
+        with self._lock:
+            self.requests_served += 1
+
+    def track_stream(self, chunks: Iterable) -> Iterator:
+        """Count a streaming response as in flight until it is fully sent or closed"""
+        with self._lock:
+            self.active_streams += 1
+        try:
+            yield from chunks
+        finally:
+            with self._lock:
+                self.active_streams -= 1
+
+    def open_websocket(self, limit: int) -> bool:
+        """Count a WebSocket connection unless the worker is at `limit` or draining"""
+        with self._lock:
+            if self.draining or self.websockets >= limit:
+                return False
+            self.websockets += 1
+            return True
+
+    def close_websocket(self) -> None:
+        with self._lock:
+            self.websockets -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "warm": self.warm,
+            "warm_error": self.warm_error,
+            "draining": self.draining,
+            "active_streams": self.active_streams,
+            "websockets": self.websockets,
+            "requests_served": self.requests_served
+        }
+
+
+lifecycle = Lifecycle()
@@ -0,0 +1,196 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from typing import Dict, Any, Iterable, Iterator, Optional
+
+# Leaf frames in these files are threads parked on a lock, queue or selector
+_IDLE_FILES = ("threading.py", "queue.py", "selectors.py")
+_MAX_DEPTH = 64
+
+
+class RequestProfile:
+    """A cProfile capture for a single request"""
+
+    def __init__(self, path: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.path = path
+        self.started = time.monotonic()
+        self.duration_ms = None
+        self.stats = None
+        self._profile = cProfile.Profile()
+
+
+class RequestProfiler:
+    """Per-request cProfile captures, kept in a small in-memory ring.
+
+    Only one capture runs per thread at a time (a second enable would replace
+    the first on Python <= 3.11, or raise on 3.12+), so a request that finds
+    one active, or cannot enable the profiler, is simply served unprofiled.
+    """
+
+    def __init__(self, keep: int = 20, sort: str = "cumulative", limit: int = 60):
+        self.keep = keep
+        self.sort = sort
+        self.limit = limit
+        self._captures: "OrderedDict[str, RequestProfile]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def start(self, path: str) -> Optional[RequestProfile]:
+        if getattr(self._local, "active", None) is not None:
+            return None
+        capture = RequestProfile(path)
+        try:
+            capture._profile.enable()
+        except ValueError:
+            return None
+        self._local.active = capture
+        return capture
+
+    def finish(self, capture: RequestProfile) -> None:
+        """Stop and store a capture; safe to call more than once"""
+        if capture._profile is None:
+            return
+        capture._profile.disable()
+        if getattr(self._local, "active", None) is capture:
+            self._local.active = None
+        capture.duration_ms = round((time.monotonic() - capture.started) * 1000, 1)
+        out = io.StringIO()
+        pstats.Stats(capture._profile, stream=out).sort_stats(self.sort).print_stats(self.limit)
+        capture.stats = out.getvalue()
+        capture._profile = None
+        with self._lock:
+            self._captures[capture.id] = capture
+            while len(self._captures) > self.keep:
+                self._captures.popitem(last=False)
+
+    def finish_after(self, capture: RequestProfile, chunks: Iterable) -> Iterator:
+        """Keep profiling a streamed body until it is fully sent or closed.
+
+        A body that is never iterated never runs this finally block, so callers
+        must also call finish() when the response closes.
+        """
+        try:
+            yield from chunks
+        finally:
+            self.finish(capture)
+
+    def get(self, capture_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            capture = self._captures.get(capture_id)
+        if capture is None:
+            return None
+        return {
+            "id": capture.id,
+            "path": capture.path,
+            "duration_ms": capture.duration_ms,
+            "stats": capture.stats
+        }
+
+    def recent(self) -> list:
+        with self._lock:
+            return [
+                {"id": c.id, "path": c.path, "duration_ms": c.duration_ms}
+                for c in reversed(self._captures.values())
+            ]
+
+
+class SamplingProfiler:
+    """Wall-clock sampling profiler that aggregates stacks of all threads.
+
+    A background thread reads sys._current_frames() every interval, so the
+    profiled code is not instrumented and overhead stays in the low percent
+    range at the default 10ms. Results are collapsed stacks
+    ("frame;frame;frame count"), the input format of flamegraph.pl and
+    speedscope. State is per worker process.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self._stacks: Counter = Counter()
+        self._samples = 0
+        self._started_at = None
+        self._stopped_at = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return (self._thread is not None and self._pid == os.getpid()
+                and self._thread.is_alive())
+
+    def start(self, interval: Optional[float] = None, duration: Optional[float] = None,
+              include_idle: bool = False) -> bool:
+        """Start sampling with fresh counters; returns False if already running"""
+        with self._lock:
+            if self.running:
+                return False
+            if interval:
+                self.interval = max(0.001, interval)
+            self._stacks = Counter()
+            self._samples = 0
+            self._started_at = time.time()
+            self._stopped_at = None
+            self._stop = threading.Event()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, args=(duration, include_idle), name="sampling-profiler", daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self.running:
+            self._thread.join(timeout=1.0)
+
+    def _run(self, duration: Optional[float], include_idle: bool) -> None:
+        own = threading.get_ident()
+        deadline = time.monotonic() + duration if duration else None
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if not include_idle and frame.f_code.co_filename.endswith(_IDLE_FILES):
+                    continue
+                self._stacks[_collapse(frame)] += 1
+            self._samples += 1
+            if deadline and time.monotonic() >= deadline:
+                break
+        self._stopped_at = time.time()
+
+    def collapsed(self) -> str:
+        stacks = self._stacks.copy()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "pid": os.getpid(),
+            "interval_ms": round(self.interval * 1000, 1),
+            "samples": self._samples,
+            "distinct_stacks": len(self._stacks),
+            "started_at": self._started_at,
+            "stopped_at": self._stopped_at
+        }
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None and len(names) < _MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+request_profiler = RequestProfiler()
+sampler = SamplingProfiler()
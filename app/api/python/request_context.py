@@ -0,0 +1,65 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional
+
+DEFAULT_SESSION = "default"
+
+
+@dataclass(frozen=True)
+class RequestContext:
+    """Everything that varies per request. Never stored on the shared HealthAssistant."""
+    persona: str
+    system_prompt: str
+    session_id: str = DEFAULT_SESSION
+    deadline: Optional[float] = None  # time.monotonic() value
+
+    @property
+    def has_session(self) -> bool:
+        """Only a client-supplied session id identifies a single user's conversation"""
+        return self.session_id != DEFAULT_SESSION
+
+    def remaining(self, minimum: float = 1.0) -> Optional[float]:
+        """Seconds left before the deadline, for use as an upstream timeout"""
+        if self.deadline is None:
+            return None
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError("Request deadline exceeded")
+        return max(minimum, remaining)
+
+
+class SessionHistory:
+    """Thread-safe conversation history keyed by session, bounded per session and overall"""
+
+    def __init__(self, max_turns: int = 50, max_sessions: int = 1000):
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, deque]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def append(self, session_id: str, turn: Dict[str, Any]) -> None:
+        with self._lock:
+            turns = self._sessions.get(session_id)
+            if turns is None:
+                turns = deque(maxlen=self.max_turns)
+                self._sessions[session_id] = turns
+                if len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            turns.append(turn)
+
+    def get(self, session_id: str) -> List[Dict[str, Any]]:
+        """Return a snapshot copy that is safe to iterate while other requests append"""
+        with self._lock:
+            return list(self._sessions.get(session_id, ()))
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def session_count(self) -> int:
+        with self._lock:
+            return len(self._sessions)
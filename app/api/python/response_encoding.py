@@ -0,0 +1,128 @@
+import gzip
+import json
+import zlib
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Bodies smaller than this are sent as-is; compression would not pay for itself
+MIN_COMPRESS_SIZE = 1024
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/x-ndjson", "text/csv"}
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, falling back to the default for unsupported types"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        if orjson is None:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, option=option).decode("utf-8")
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is None:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick 'br' or 'gzip' from an Accept-Encoding header, honouring q=0"""
+    if not accept_encoding:
+        return None
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+
+    def allowed(name: str) -> bool:
+        return accepted.get(name, accepted.get("*", 0.0)) > 0
+
+    if brotli is not None and allowed("br"):
+        return "br"
+    if allowed("gzip"):
+        return "gzip"
+    return None
+
+
+def compress_bytes(data: bytes, encoding: str, static: bool = False) -> bytes:
+    """One-shot compression. Static payloads are compressed once, so they get the highest level."""
+    if encoding == "br":
+        return brotli.compress(data, quality=11 if static else 4)
+    return gzip.compress(data, compresslevel=9 if static else 6)
+
+
+def compress_stream(chunks: Iterable, encoding: str) -> Iterator[bytes]:
+    """Compress a streamed body, flushing after every chunk so events are not held back"""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=4)
+        for chunk in chunks:
+            data = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+            yield compressor.process(data) + compressor.flush()
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+        for chunk in chunks:
+            data = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+            yield compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+def compress_response(response, accept_encoding: Optional[str]):
+    """after_request hook body: compress buffered JSON responses when the client allows it"""
+    if (response.direct_passthrough
+            or response.is_streamed
+            or response.status_code < 200 or response.status_code >= 300
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding is None:
+        return response
+
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+
+    response.set_data(compress_bytes(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+class StaticPayload:
+    """A constant JSON body serialized once, with compressed variants built on first use"""
+
+    def __init__(self, obj):
+        self.body = orjson.dumps(obj) if orjson is not None else json.dumps(obj).encode("utf-8")
+        self._encoded: Dict[str, bytes] = {}
+
+    def encoded(self, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        """Return (body, Content-Encoding actually applied)"""
+        if encoding is None or len(self.body) < MIN_COMPRESS_SIZE:
+            return self.body, None
+        if encoding not in self._encoded:
+            self._encoded[encoding] = compress_bytes(self.body, encoding, static=True)
+        return self._encoded[encoding], encoding
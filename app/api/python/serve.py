@@ -0,0 +1,141 @@
+"""Production launcher for the Flask service.
+
+    python serve.py
+
+Runs gunicorn with threaded workers. The app module, provider clients and
+in-memory indexes are loaded once in the master (preload) and shared
+copy-on-write by the forked workers. Workers are recycled after a jittered
+number of requests to bound memory growth, and on shutdown or recycle they
+stop receiving new traffic while in-flight /api/chat/stream responses finish.
+
+Configuration (environment):
+    BIND                  address to bind (default 0.0.0.0:$PORT, PORT default 5000)
+    WEB_CONCURRENCY       worker processes (default 2 * CPUs + 1, capped at 8; 1 when
+                          ANALYTICS_ENABLED=false, see below)
+    THREADS               threads per worker (default 8)
+    WS_MAX_CONNECTIONS    WebSocket connections per worker, each holding a thread (default THREADS // 2)
+    MAX_REQUESTS          recycle a worker after this many requests (default 1000, 0 disables)
+    MAX_REQUESTS_JITTER   random extra requests per worker before recycling (default 100)
+    GRACEFUL_TIMEOUT      seconds in-flight streams get to finish on shutdown (default 120)
+    TIMEOUT               worker heartbeat timeout in seconds (default 180)
+    TRUSTED_PROXIES       proxy addresses/CIDRs whose X-Forwarded-For is used for rate limiting
+                          (default none: the peer address is the client). The Next.js
+                          /api/chat route forwards X-Forwarded-For and X-Session-Id, so
+                          list the addresses it calls from here
+    ADMISSION_IP_MULTIPLIER
+                          rate and burst of a per-IP bucket relative to a per-session
+                          bucket (default 10, as one address can front many users)
+
+Session history is shared between workers through the analytics store. With
+ANALYTICS_ENABLED=false each worker only knows the turns it answered itself,
+so more than one worker needs a load balancer with session affinity on
+X-Session-Id.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+
+from gunicorn.app.base import BaseApplication
+
+logger = logging.getLogger(__name__)
+
+
+def _int_env(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+def build_config() -> dict:
+    graceful_timeout = _int_env('GRACEFUL_TIMEOUT', 120)
+    shared_history = os.getenv('ANALYTICS_ENABLED', 'true').lower() == 'true'
+    workers = _int_env('WEB_CONCURRENCY', min(8, multiprocessing.cpu_count() * 2 + 1) if shared_history else 1)
+    if workers > 1 and not shared_history:
+        logger.warning("ANALYTICS_ENABLED=false with several workers: route each X-Session-Id to one worker")
+    return {
+        "bind": os.getenv('BIND', f"0.0.0.0:{os.getenv('PORT', '5000')}"),
+        "workers": workers,
+        "worker_class": "gthread",
+        "threads": _int_env('THREADS', 8),
+        "max_requests": _int_env('MAX_REQUESTS', 1000),
+        "max_requests_jitter": _int_env('MAX_REQUESTS_JITTER', 100),
+        "graceful_timeout": graceful_timeout,
+        "timeout": _int_env('TIMEOUT', 180),
+        "keepalive": 5,
+        "preload_app": True,
+        "accesslog": "-",
+        "post_fork": post_fork,
+        "post_worker_init": post_worker_init,
+        "worker_exit": worker_exit
+    }
+
+
+def warm_up():
+    """Import the app and build the shared assistant before workers fork"""
+    from app import app, HealthAssistant
+    from lifecycle import lifecycle
+
+    try:
+        HealthAssistant()
+        lifecycle.mark_warm()
+    except Exception as e:
+        # Serve anyway; /api/ready reports the failure so the pod is taken out of rotation
+        logger.error(f"Warm-up failed: {str(e)}")
+        lifecycle.mark_warm(e)
+    return app
+
+
+def post_fork(server, worker):
+    from lifecycle import lifecycle
+    from diagnostics import prober
+
+    # Counters inherited from the master belong to another process
+    lifecycle.pid = os.getpid()
+    lifecycle.active_streams = 0
+    lifecycle.websockets = 0
+    lifecycle.requests_served = 0
+    # Probe upstreams right away so readiness has real results before traffic arrives
+    prober.ensure_started()
+
+
+def post_worker_init(worker):
+    from lifecycle import lifecycle
+
+    # Gunicorn installs its own SIGTERM handler during init; chain ours in front so
+    # readiness flips to 'draining' before the worker stops accepting connections
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def on_term(signum, frame):
+        lifecycle.start_draining()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, on_term)
+
+
+def worker_exit(server, worker):
+    from lifecycle import lifecycle
+
+    # The gthread worker has already waited up to graceful_timeout for in-flight requests
+    lifecycle.start_draining()
+    if lifecycle.active_streams or lifecycle.websockets:
+        logger.warning(
+            f"Worker {worker.pid} exiting with {lifecycle.active_streams} open streams "
+            f"and {lifecycle.websockets} websockets"
+        )
+
+
+class ProductionServer(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return warm_up()
+
+
+if __name__ == '__main__':
+    ProductionServer(build_config()).run()
@@ -0,0 +1,163 @@
+import json
+import queue
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionRejected
+from chat_channel import InProcessClient
+
+
+class FakeAssistant:
+    """Stands in for HealthAssistant: streams numbered tokens, honours cancel and release"""
+
+    def __init__(self, tokens=5, delay=0.01):
+        self.tokens = tokens
+        self.delay = delay
+        self.cancelled = []
+        self.histories = {}
+
+    def get_streaming_response(self, query, persona="general_med", session_id=None, cancel=None, release=None):
+        for i in range(self.tokens):
+            if cancel is not None and cancel.is_set():
+                self.cancelled.append(query)
+                yield json.dumps({"status": "cancelled"})
+                return
+            time.sleep(self.delay)
+            yield json.dumps({"status": "streaming", "content": f"{query}:{i}", "persona": persona})
+        if session_id:
+            self.histories.setdefault(session_id, []).append({"query": query})
+        yield json.dumps({"status": "complete", "full_response": query, "persona": persona})
+        if release is not None:
+            release()
+        yield json.dumps({"status": "title", "title": query.title()})
+
+    def get_conversation_history(self, session_id=None):
+        return list(self.histories.get(session_id, []))
+
+
+def collect(client, done, timeout=5.0):
+    """Receive messages until done(messages) is true"""
+    messages = []
+    deadline = time.monotonic() + timeout
+    while not done(messages):
+        messages.append(client.receive(timeout=max(0.01, deadline - time.monotonic())))
+    return messages
+
+
+def statuses(messages, request_id):
+    return [m["status"] for m in messages if m.get("request_id") == request_id]
+
+
+@pytest.fixture
+def client():
+    clients = []
+
+    def make(assistant=None, **options):
+        clients.append(InProcessClient(assistant or FakeAssistant(), **options))
+        return clients[-1]
+
+    yield make
+    for c in clients:
+        c.close()
+
+
+def test_concurrent_turns_are_multiplexed(client):
+    c = client()
+    c.send({"type": "chat", "request_id": "a", "query": "alpha", "persona": "glp1"})
+    c.send({"type": "chat", "request_id": "b", "query": "beta"})
+    messages = collect(c, lambda ms: sum(m["status"] == "title" for m in ms) == 2)
+
+    for request_id, query in (("a", "alpha"), ("b", "beta")):
+        tokens = [m["content"] for m in messages if m.get("request_id") == request_id and m["status"] == "streaming"]
+        assert tokens == [f"{query}:{i}" for i in range(5)]
+        assert statuses(messages, request_id)[-2:] == ["complete", "title"]
+    assert {m["persona"] for m in messages if m.get("request_id") == "a" and "persona" in m} == {"glp1"}
+    # Both turns were in flight at the same time
+    first_complete = next(i for i, m in enumerate(messages) if m["status"] == "complete")
+    assert {m["request_id"] for m in messages[:first_complete]} == {"a", "b"}
+
+
+def test_cancel_aborts_the_stream(client):
+    assistant = FakeAssistant(tokens=200)
+    c = client(assistant)
+    c.send({"type": "chat", "request_id": "r1", "query": "long"})
+    collect(c, lambda ms: any(m["status"] == "streaming" for m in ms))
+    c.send({"type": "cancel", "request_id": "r1"})
+    messages = collect(c, lambda ms: any(m["status"] == "cancelled" for m in ms))
+    assert "complete" not in statuses(messages, "r1")
+    assert assistant.cancelled == ["long"]
+
+
+def test_request_id_rules(client):
+    c = client(FakeAssistant(tokens=50), max_inflight=1)
+    c.send({"type": "chat", "request_id": "r1", "query": "one"})
+    c.send({"type": "chat", "request_id": "r1", "query": "again"})
+    c.send({"type": "chat", "request_id": "r2", "query": "two"})
+    c.send({"type": "cancel", "request_id": "nope"})
+    c.send({"type": "chat", "query": "no id"})
+    errors = [m for m in collect(c, lambda ms: sum(m["status"] == "error" for m in ms) == 4)
+              if m["status"] == "error"]
+    assert [e["request_id"] for e in errors] == ["r1", "r2", "nope", None]
+
+
+def test_history_is_pushed_only_for_sessions(client):
+    c = client(session_id="s1")
+    c.send({"type": "chat", "request_id": "r1", "query": "first"})
+    messages = collect(c, lambda ms: any(m["status"] == "title" for m in ms))
+    history = [m for m in messages if m["status"] == "history"]
+    assert history[0]["session_id"] == "s1"
+    assert history[0]["conversation_history"] == [{"query": "first"}]
+
+    anonymous = client()
+    anonymous.send({"type": "chat", "request_id": "r1", "query": "first"})
+    messages = collect(anonymous, lambda ms: any(m["status"] == "title" for m in ms))
+    assert "history" not in statuses(messages, "r1")
+
+
+def test_admission_rejection_and_early_release(client):
+    released = []
+
+    class Ticket:
+        def release(self):
+            released.append(True)
+
+    def admit(query, persona):
+        if query == "blocked":
+            raise AdmissionRejected("Rate limit exceeded", 2.5)
+        return Ticket()
+
+    c = client(admit=admit)
+    c.send({"type": "chat", "request_id": "no", "query": "blocked"})
+    c.send({"type": "chat", "request_id": "ok", "query": "allowed"})
+    messages = collect(c, lambda ms: any(m["status"] == "title" for m in ms)
+                       and any(m["status"] == "error" for m in ms))
+    error = next(m for m in messages if m["status"] == "error")
+    assert (error["request_id"], error["retry_after"]) == ("no", "3")
+    # Released once after 'complete' and again (idempotently for real tickets) when the turn ends
+    assert len(released) == 2
+
+
+def test_drain_finishes_in_flight_turns(client):
+    draining = threading.Event()
+    c = client(FakeAssistant(tokens=20), draining=draining.is_set)
+    c.send({"type": "chat", "request_id": "r1", "query": "inflight"})
+    collect(c, lambda ms: any(m["status"] == "streaming" for m in ms))
+    draining.set()
+    messages = collect(c, lambda ms: any(m["status"] == "title" for m in ms))
+    assert "draining" in [m["status"] for m in messages]
+    assert "complete" in statuses(messages, "r1")
+    c._thread.join(timeout=2)
+    assert not c._thread.is_alive()
+
+
+def test_invalid_messages_get_errors(client):
+    c = client()
+    c._to_server.put("not json")
+    c.send({"type": "unknown"})
+    c.send({"type": "ping", "request_id": "p"})
+    messages = collect(c, lambda ms: any(m["status"] == "pong" for m in ms))
+    assert [m["status"] for m in messages] == ["error", "error", "pong"]
+    with pytest.raises(queue.Empty):
+        c.receive(timeout=0.05)
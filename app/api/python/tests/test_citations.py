@@ -0,0 +1,97 @@
+import random
+
+import pytest
+
+from citations import CitationStreamProcessor, normalize_url, process_citations
+
+SOURCES = "\n\nSources:\n1. [FDA label](https://www.fda.gov/ozempic)\n2. [NEJM](https://www.nejm.org/doi/1)\n3. [ADA](https://diabetes.org/glp1)\n"
+
+CORPUS = [
+    "Semaglutide slows gastric emptying [[1]](#1) and reduces appetite [[2]](#2)." + SOURCES,
+    "It slows digestion[3] and reduces appetite[1]; nausea is common[2]." + SOURCES,
+    "Nausea eases over weeks [2] and with slow titration [[3]]." + SOURCES,
+    "Take it weekly[[2]](#2), same day each week [1](#1)." + SOURCES,
+    "See the [1](https://www.fda.gov/ozempic) label, the first dose is items[0] of the schedule [2].",
+    "Unclosed [12 bracket, a [link](https://example.org) and [[x]] stay as written [7",
+    "No citations at all.\nJust two lines.",
+    "Sources at the end [1].\n\n## References\n- [1] FDA: https://www.fda.gov/ozempic?utm_source=x\n- [2] <https://nejm.org/a>\n",
+]
+
+
+def stream(text, sizes):
+    processor = CitationStreamProcessor()
+    out = []
+    position = 0
+    for size in sizes:
+        out.append(processor.feed(text[position:position + size]))
+        position += size
+    out.append(processor.feed(text[position:]))
+    out.append(processor.close())
+    return "".join(out), processor.citations
+
+
+def chunkings(text, rng):
+    yield [1] * len(text)
+    yield [len(text)]
+    # Split right before and after each character the state machine cares about
+    for index, char in enumerate(text):
+        if char in "[]()#\n":
+            yield [index, 1]
+    for _ in range(50):
+        yield [rng.randint(1, 8) for _ in range(len(text))]
+
+
+@pytest.mark.parametrize("text", CORPUS)
+def test_streamed_output_matches_whole_output(text):
+    expected = process_citations(text)
+    rng = random.Random(text)
+    for sizes in chunkings(text, rng):
+        assert stream(text, sizes) == expected, sizes
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("helps[3].", "helps[[1]](#1)."),
+    ("helps[[3]](#3).", "helps[[1]](#1)."),
+    ("helps [[3]].", "helps [[1]](#1)."),
+    ("helps [3](#3).", "helps [[1]](#1)."),
+    ("helps[3][1].", "helps[[1]](#1)[[2]](#2)."),
+])
+def test_glued_and_malformed_citations(text, expected):
+    assert process_citations(text)[0] == expected
+
+
+@pytest.mark.parametrize("text", [
+    "See [1](https://www.fda.gov/ozempic) for details.",
+    "The first entry is items[0].",
+    "An unclosed [3 bracket.",
+    "A [link](https://example.org) and [[notes]].",
+])
+def test_non_citations_are_left_alone(text):
+    assert process_citations(text) == (text, [])
+
+
+def test_sources_are_renumbered_with_inline_citations():
+    text, citations = process_citations(CORPUS[1])
+    # [3] is cited first, so it becomes 1 and the Sources block follows
+    assert text.startswith("It slows digestion[[1]](#1) and reduces appetite[[2]](#2); nausea is common[[3]](#3).")
+    assert [(c["n"], c["title"]) for c in citations] == [(1, "ADA"), (2, "FDA label"), (3, "NEJM")]
+    assert text.endswith("1. [ADA](https://diabetes.org/glp1)\n2. [FDA label](https://www.fda.gov/ozempic)\n"
+                         "3. [NEJM](https://www.nejm.org/doi/1)")
+
+
+def test_bare_sources_are_parsed_and_normalized():
+    _, citations = process_citations(CORPUS[7])
+    assert citations == [
+        {"n": 1, "title": "FDA", "url": "https://www.fda.gov/ozempic"},
+        {"n": 2, "title": "nejm.org", "url": "https://nejm.org/a"},
+    ]
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://WWW.FDA.gov/a?utm_source=x&id=1#top", "https://www.fda.gov/a?id=1"),
+    ("https://nejm.org", "https://nejm.org/"),
+    ("https://nejm.org/a).", "https://nejm.org/a"),
+    ("not a url", "not a url"),
+])
+def test_normalize_url(url, expected):
+    assert normalize_url(url) == expected
@@ -0,0 +1,93 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("flask")
+
+os.environ.setdefault("PPLX_API_KEY", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ["ANALYTICS_ENABLED"] = "false"
+os.environ["DIAGNOSTICS_PROBES"] = "off"
+os.environ["ANSWER_INDEX_PATH"] = os.path.join(os.path.dirname(__file__), "missing_answer_index.json")
+
+import app as app_module  # noqa: E402
+
+PERSONAS = ["glp1", "general_med"]
+
+
+class FakePerplexityResponse:
+    def __init__(self, content):
+        self._content = content
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"choices": [{"message": {"content": self._content}}]}
+
+
+class FakeOpenAI:
+    """Medication validator that always answers YES"""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        message = SimpleNamespace(content="YES")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def assistant(monkeypatch):
+    assistant = app_module.HealthAssistant()
+    monkeypatch.setattr(assistant, "openai_client", FakeOpenAI())
+    monkeypatch.setattr(assistant, "refine_titles", False)
+    prompt_owner = {prompt: persona for persona, prompt in assistant.system_prompts.items()}
+
+    def fake_post(url, headers=None, json=None, timeout=None, **kwargs):
+        # Yield mid-request so threads interleave, then echo which persona's prompt was sent
+        time.sleep(random.uniform(0, 0.005))
+        messages = json["messages"]
+        persona = prompt_owner.get(messages[0]["content"], "unknown")
+        return FakePerplexityResponse(f"prompt={persona} query={messages[-1]['content']}")
+
+    monkeypatch.setattr(app_module.requests, "post", fake_post)
+    return assistant
+
+
+def test_mixed_personas_from_many_threads(assistant):
+    barrier = threading.Barrier(32)
+
+    def ask(worker):
+        barrier.wait()
+        results = []
+        for turn in range(10):
+            persona = PERSONAS[(worker + turn) % 2]
+            query = f"semaglutide dosing question {worker}-{turn}"
+            response = assistant.get_medical_response(query, persona, f"session-{worker}")
+            results.append((worker, persona, query, response))
+        return results
+
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        outcomes = [result for results in pool.map(ask, range(32)) for result in results]
+
+    assert len(outcomes) == 320
+    for worker, persona, query, response in outcomes:
+        assert response["status"] == "success", response
+        assert response["persona"] == persona
+        assert response["response"] == f"prompt={persona} query={query}"
+        # History is per session: every turn in it belongs to this worker
+        assert all(turn["query"].startswith(f"semaglutide dosing question {worker}-")
+                   for turn in response["conversation_history"])
+
+    for worker in range(32):
+        history = assistant.get_conversation_history(f"session-{worker}")
+        assert [turn["query"] for turn in history] == [
+            f"semaglutide dosing question {worker}-{turn}" for turn in range(10)
+        ]
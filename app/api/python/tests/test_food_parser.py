@@ -0,0 +1,98 @@
+import random
+
+import pytest
+
+from food_parser import FoodAnalysisStreamParser, parse_food_analysis, parse_confidence
+
+CORPUS = [
+    "Category: Clearly Healthy\nConfidence: 92%\nAnalysis: Grilled salmon with steamed broccoli.\nLean protein and fiber.",
+    "**Category:** **Borderline**\n**Confidence:** 85 %\n**Analysis:**\nWhite rice with a fried egg.\nModerate portion.",
+    "Category: mixed\nConfidence: 0.85\nAnalysis: Burger with side salad.",
+    "Category: Clearly Unhealthy\r\nConfidence: 70 percent\r\nAnalysis: Deep-fried dessert.\r\nHigh sugar and fat.\r\n",
+    "Category: Clearly Healthy\nConfidence: 88%\nOatmeal with berries.\nGood choice for steady glucose.",
+    "# Category - Borderline\n> Confidence: 60/100\n\nAnalysis:\n\n- Pasta in cream sauce\n- Large serving",
+    "Category: Mixed\nConfidence: 75%\n",
+    "Category: Clearly Unhealthy\nConfidence: 0.9",
+]
+
+
+def stream(text, sizes):
+    parser = FoodAnalysisStreamParser()
+    events = []
+    position = 0
+    for size in sizes:
+        events.extend(parser.feed(text[position:position + size]))
+        position += size
+    events.extend(parser.feed(text[position:]))
+    events.extend(parser.close())
+    return parser.result(), events
+
+
+def chunkings(text, rng):
+    yield [1] * len(text)
+    yield [len(text)]
+    # Split right before and after each delimiter that the parser cares about
+    for index, char in enumerate(text):
+        if char in "*:\r\n%":
+            yield [index, 1]
+    for _ in range(50):
+        yield [rng.randint(1, 8) for _ in range(len(text))]
+
+
+@pytest.mark.parametrize("text", CORPUS)
+def test_streamed_parse_matches_whole_parse(text):
+    expected = parse_food_analysis(text)
+    rng = random.Random(text)
+    for sizes in chunkings(text, rng):
+        result, events = stream(text, sizes)
+        assert result == expected, sizes
+        assert "".join(value for kind, value in events if kind == "analysis").strip() or not expected["analysis"]
+
+
+def test_fields_are_emitted_before_analysis():
+    _, events = stream(CORPUS[1], [1] * len(CORPUS[1]))
+    kinds = [kind for kind, _ in events]
+    assert kinds[:2] == ["category", "confidence"]
+    assert set(kinds[2:]) == {"analysis"}
+
+
+@pytest.mark.parametrize("text, category, confidence", [
+    (CORPUS[0], "Clearly Healthy", 92.0),
+    (CORPUS[1], "Borderline", 85.0),
+    (CORPUS[2], "Mixed", 85.0),
+    (CORPUS[3], "Clearly Unhealthy", 70.0),
+    (CORPUS[5], "Borderline", 60.0),
+])
+def test_field_values(text, category, confidence):
+    result = parse_food_analysis(text)
+    assert result["category"] == category
+    assert result["confidence"] == confidence
+    assert "**" not in result["analysis"]
+    assert "\r" not in result["analysis"]
+
+
+def test_missing_analysis_header_keeps_text():
+    assert parse_food_analysis(CORPUS[4])["analysis"] == "Oatmeal with berries.\nGood choice for steady glucose."
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("85%", 85.0), ("85 %", 85.0), ("0.85", 85.0), ("85 percent", 85.0),
+    ("85/100", 85.0), ("0,9", 90.0), ("about 120%", 100.0), ("unknown", None),
+])
+def test_parse_confidence(raw, expected):
+    assert parse_confidence(raw) == expected
+
+
+def test_single_character_chunks_stay_linear():
+    text = "Category: Mixed\nConfidence: 80%\nAnalysis:\n" + "Balanced plate with vegetables.\n" * 5000
+    parser = FoodAnalysisStreamParser()
+    longest_line = max(len(line) for line in text.split("\n"))
+    buffered = []
+    for char in text:
+        parser.feed(char)
+        buffered.append(len(parser._buffer))
+    # Work per chunk is bounded by the partial line held back, never by the text so far
+    assert max(buffered) <= longest_line
+    assert max(buffered[text.index("Analysis:\n") + len("Analysis:\n"):]) == 0
+    parser.close()
+    assert parser.result()["analysis"] == parse_food_analysis(text)["analysis"]
@@ -0,0 +1,65 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip("flask")
+
+os.environ.setdefault("PPLX_API_KEY", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ["ANALYTICS_ENABLED"] = "false"
+os.environ["DIAGNOSTICS_PROBES"] = "off"
+
+import app as app_module  # noqa: E402
+from analytics_store import AnalyticsStore  # noqa: E402
+from request_context import SessionHistory  # noqa: E402
+
+
+def turn(turn_id, query):
+    # The store stamps turns with its own write time
+    return {"id": turn_id, "query": query, "response": "answer", "persona": "glp1", "title": query}
+
+
+@pytest.fixture
+def assistant(monkeypatch, tmp_path):
+    assistant = app_module.HealthAssistant()
+    store = AnalyticsStore(str(tmp_path / "analytics.db"), flush_interval=0.05)
+    monkeypatch.setattr(assistant, "analytics", store)
+    monkeypatch.setattr(assistant, "history", SessionHistory())
+    yield assistant
+    store.close()
+
+
+def other_worker_writes(path, session_id, turns):
+    """Another worker process shares only the database file"""
+    store = AnalyticsStore(path, flush_interval=0.05)
+    for t in turns:
+        store.record_chat_turn(session_id, t, "general")
+    store.close()
+
+
+def test_history_includes_turns_from_other_workers(assistant):
+    other_worker_writes(assistant.analytics.path, "s1", [turn("a", "first")])
+    # This worker's own turn is not flushed yet; it must still be served
+    ctx = assistant.new_context("glp1", "s1")
+    mine = assistant.record_turn(ctx, "second", "answer", "general")
+
+    history = assistant.get_conversation_history("s1")
+    assert [t["query"] for t in history] == ["first", "second"]
+    assert assistant.prior_turns(ctx) == history
+
+    # A later turn on the other worker shows up although this worker's history is not empty;
+    # timestamps have one-second resolution
+    time.sleep(1.1)
+    other_worker_writes(assistant.analytics.path, "s1", [turn("c", "third")])
+    assert [t["query"] for t in assistant.get_conversation_history("s1")] == ["first", "second", "third"]
+    assert sum(t["id"] == mine["id"] for t in assistant.get_conversation_history("s1")) == 1
+
+
+def test_history_without_store_is_per_worker(assistant, monkeypatch):
+    monkeypatch.setattr(assistant, "analytics", None)
+    ctx = assistant.new_context("glp1", "s2")
+    assistant.record_turn(ctx, "only", "answer", "general")
+    assert [t["query"] for t in assistant.get_conversation_history("s2")] == ["only"]
+    assert assistant.get_conversation_history(None) == []